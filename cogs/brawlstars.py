@@ -7,17 +7,20 @@ import os
 import brawlstats
 import datadog
 import discord
-from cachetools import TTLCache
 from datetime import datetime
 from discord.ext import commands
 
 import box
 from ext import utils
+from ext.cache import APICache
+from ext.clanstats import BoardScheduler, board_results, fetch_clans
 from ext.command import cog, command
 from ext.context import NoContext
 from ext.embeds import brawlstars
 from ext.paginator import Paginator, WikiPaginator
-from locales.i18n import Translator
+from ext.prefetch import Prefetcher
+from ext.ratelimit import TokenBucket
+from locales.i18n import Translator, current_language
 
 _ = Translator('Brawl Stars', __file__)
 
@@ -30,6 +33,27 @@ shortcuts = {
     'boom': 'QCGUUYJ'
 }
 
+# (soft, hard) TTLs of the API cache in seconds, see ext.cache.APICache
+cache_policies = {
+    'get_player': (180, 900),
+    'get_club': (180, 900),
+    'get_leaderboard': (600, 3600),
+    'get_events': (300, 1800),
+    'rumbleboard': (600, 3600),
+    'bossboard': (600, 3600)
+}
+
+# models returned by the methods of brawlstats.Client, anything else is a leaderboard box
+response_models = {
+    'get_player': brawlstats.Player,
+    'get_club': brawlstats.Club,
+    'get_leaderboard': brawlstats.Leaderboard,
+    'get_events': brawlstats.Events,
+    'get_constants': brawlstats.Constants,
+    'get_misc': brawlstats.MiscData,
+    'search_club': brawlstats.PartialClub
+}
+
 
 class TagCheck(commands.UserConverter):
 
@@ -71,10 +95,19 @@ class Brawl_Stars:
         self.bot = bot
         self.alias = 'bs'
         self.conv = TagCheck()
-        self.cache = TTLCache(500, 180)
+        self.prefetcher = Prefetcher('brawlstars', cost=2)
+        self.cache = APICache(
+            bot.api_cache, 'brawlstars', cache_policies,
+            fallback=(brawlstats.RequestError,),
+            passthrough=(brawlstats.NotFoundError,),
+            dump=self.dump_response,
+            load=self.load_response
+        )
+        self.clanstats_bucket = TokenBucket(rate=10, capacity=20)
+        self.clanstats_schedule = BoardScheduler()
         self.bs = brawlstats.core.Client(
             os.getenv('brawlstars'),
-            session=bot.session,
+            session=bot.sessions.get('brawlstars'),
             is_async=True,
             timeout=30,
             url=os.getenv('bs_url')
@@ -91,10 +124,11 @@ class Brawl_Stars:
                 await resp.json(),
                 camel_killer_box=True
             )
+        brawlstars.index_brawlers(self.constants)
 
     async def __local_check(self, ctx):
         if isinstance(ctx.channel, discord.TextChannel):
-            guild_info = await self.bot.mongo.config.guilds.find_one({'guild_id': str(ctx.guild.id)}) or {}
+            guild_info = await self.bot.guild_config.get(ctx.guild.id)
             return guild_info.get('games', {}).get(self.__class__.__name__, True)
         else:
             return True
@@ -162,38 +196,57 @@ class Brawl_Stars:
     async def request(self, method, *args, **kwargs):
         leaderboard = kwargs.pop('leaderboard', False)
         reason = kwargs.pop('reason', 'command')
+        key = self.cache.key(method, *args, **kwargs)
+        return await self.cache.get(key, self._request, leaderboard, method, reason, *args, **kwargs)
+
+    @staticmethod
+    def dump_response(method, data):
+        """Converts a response to JSON for the second level cache"""
+        if isinstance(data, box.Box):
+            return data.to_dict()
+        if isinstance(data, list):
+            return [i.raw_data for i in data]
+        return data.raw_data
+
+    def load_response(self, method, payload, created):
+        """Rebuilds a response dumped by dump_response"""
         try:
-            data = self.cache[f'{method}{args}{kwargs}']
+            model = response_models[method]
         except KeyError:
-            if leaderboard:
-                speed = time.time()
-                async with self.bot.session.get(
-                    f'https://leaderboard.brawlstars.com/{method}.jsonp?_={int(time.time()) - 4}'
-                ) as resp:
-                    speed = time.time() - speed
-                    datadog.statsd.increment('statsy.requests', 1, [
-                        'game:brawlstars', f'code:{resp.status}', f'method:{method}', f'reason:{reason}'
-                    ])
-                    data = box.Box(json.loads((await resp.text()).replace('jsonCallBack(', '')[:-2]), camel_killer_box=True)
-            else:
-                speed = time.time()
-                data = await getattr(self.bs, method)(*args, **kwargs)
-
+            return box.Box(payload, camel_killer_box=True)
+
+        if isinstance(payload, list):
+            return [model(self.bs, None, i) for i in payload]
+        return model(self.bs, None, payload)
+
+    async def _request(self, leaderboard, method, reason, *args, **kwargs):
+        if leaderboard:
+            speed = time.time()
+            async with self.bot.sessions.get('brawlstars').get(
+                f'https://leaderboard.brawlstars.com/{method}.jsonp?_={int(time.time()) - 4}'
+            ) as resp:
                 speed = time.time() - speed
-
-                if isinstance(data, list):
-                    status_code = 'list'
-                else:
-                    status_code = data.resp.status
-
-                datadog.statsd.increment('statsy.api_latency', 1, [
-                    'game:brawlstars', f'speed:{speed}', f'method:{method}'
-                ])
                 datadog.statsd.increment('statsy.requests', 1, [
-                    'game:brawlstars', f'code:{status_code}', f'method:{method}', f'reason:{reason}'
+                    'game:brawlstars', f'code:{resp.status}', f'method:{method}', f'reason:{reason}'
                 ])
+                data = box.Box(json.loads((await resp.text()).replace('jsonCallBack(', '')[:-2]), camel_killer_box=True)
+        else:
+            speed = time.time()
+            data = await getattr(self.bs, method)(*args, **kwargs)
 
-            self.cache[f'{method}{args}{kwargs}'] = data
+            speed = time.time() - speed
+
+            if isinstance(data, list):
+                status_code = 'list'
+            else:
+                status_code = data.resp.status
+
+            datadog.statsd.increment('statsy.api_latency', 1, [
+                'game:brawlstars', f'speed:{speed}', f'method:{method}'
+            ])
+            datadog.statsd.increment('statsy.requests', 1, [
+                'game:brawlstars', f'code:{status_code}', f'method:{method}', f'reason:{reason}'
+            ])
 
         return data
 
@@ -346,20 +399,30 @@ class Brawl_Stars:
             ems = brawlstars.format_brawler_stats(ctx, brawler)
             await WikiPaginator(ctx, brawler_power, *ems).start()
 
+    async def on_command(self, ctx):
+        if ctx.cog is self:
+            self.prefetcher.used(ctx.author.id)
+
     async def on_typing(self, channel, user, when):
+        if self.bot.is_closed() or user.bot or not self.prefetcher.check(user.id):
+            return
+
         ctx = NoContext(self.bot, user, channel=channel)
-        if self.bot.is_closed() or not await self.__local_check(ctx) or user.bot:
+        if not await self.__local_check(ctx):
             return
 
         if isinstance(ctx.channel, discord.TextChannel):
-            ctx.language = (await self.bot.mongo.config.guilds.find_one({'guild_id': str(ctx.guild.id)}) or {}).get('language', 'messages')
+            ctx.language = (await self.bot.guild_config.get(ctx.guild.id)).get('language', 'messages')
         else:
             ctx.language = 'messages'
+        current_language.set(ctx.language)
 
         guild_id = getattr(ctx.guild, 'id', 'DM')
         try:
             datadog.statsd.increment('statsy.magic_caching.check', 1, [f'user:{user.id}', f'guild:{guild_id}', 'game:brawlstars'])
             tag = await self.resolve_tag(ctx, None)
+            if not self.prefetcher.spend():
+                return
 
             try:
                 player = await self.request('get_player', tag, reason='magic caching')
@@ -418,57 +481,78 @@ class Brawl_Stars:
                     except (AttributeError, discord.NotFound):
                         pass
 
-    async def get_club_inf(self, tag):
+    async def get_club_inf(self, tag, retries=3):
         try:
             return await self.request('get_club', tag, reason='clanstats')
-        except brawlstats.MaintenanceError:
-            await asyncio.sleep(60 * 5)
-            return await self.get_club_inf(tag)
+        except (brawlstats.NotFoundError, brawlstats.MaintenanceError):
+            # during maintenance the club is skipped until the next cycle
+            # instead of holding a fetch_clans slot
+            raise
         except brawlstats.RequestError:
+            if not retries:
+                raise
             await asyncio.sleep(1)
-            return await self.get_club_inf(tag)
+            return await self.get_club_inf(tag, retries - 1)
 
-    async def get_clubs(self, *tags):
-        clans = []
-        for t in tags:
-            clans.append(await self.get_club_inf(t))
-            await asyncio.sleep(0.5)
-        return clans
+    async def clanupdate(self, *guilds):
+        """Refreshes the club stats board of a guild config, or of every guild
 
-    async def clanupdate(self, clan=None):
-        if not clan:
+        Clubs shared by several boards are only fetched once.
+        """
+        if not guilds:
             guilds = await self.bot.mongo.config.guilds.find({'bsclubinfo': {'$exists': True}}).to_list(None)
-        else:
-            guilds = [clan]
+
+        tags = [t for g in guilds for t in g['bsclubinfo']['clubs']]
+        results = await fetch_clans('brawlstars', tags, self.get_club_inf, self.clanstats_bucket)
 
         for g in guilds:
-            m = g['bsclubinfo']
-            clans = await self.get_clubs(*m['clubs'])
+            try:
+                await self.update_club_board(g, results)
+            except discord.HTTPException:
+                pass
 
-            embed = discord.Embed(title="Club Statistics!", color=0xf1c40f, timestamp=datetime.utcnow())
-            total_members = 0
+    async def update_club_board(self, g, results):
+        m = g['bsclubinfo']
+        clans = board_results(m['clubs'], results)
+        if not clans:
+            return
+
+        embed = discord.Embed(title="Club Statistics!", color=0xf1c40f, timestamp=datetime.utcnow())
+        total_members = 0
 
-            for i in range(len(clans)):
-                embed.add_field(name=clans[i].name, value=brawlstars.format_club_stats(clans[i]))
-                total_members += len(clans[i].members)
+        for clan in clans:
+            embed.add_field(name=clan.name, value=brawlstars.format_club_stats(clan))
+            total_members += len(clan.members)
 
-            embed.add_field(name='More Info', value=f"{utils.e('friends')} {total_members}/{100*len(clans)}", inline=False)
+        embed.add_field(name='More Info', value=f"{utils.e('friends')} {total_members}/{100*len(clans)}", inline=False)
+
+        try:
+            channel = self.bot.get_channel(int(m['channel']))
+            message = await channel.get_message(int(m['message']))
+        except (AttributeError, discord.NotFound):
+            message = None
 
+        if not message:
             try:
-                channel = self.bot.get_channel(int(m['channel']))
-                message = await channel.get_message(int(m['message']))
+                message = await self.bot.get_channel(int(m['channel'])).send('Clan Stats')
             except AttributeError:
-                message = None
+                await self.bot.guild_config.update(g['guild_id'], {'$unset': {'bsclubinfo': ''}})
+                return
+            await self.bot.guild_config.update(g['guild_id'], {'$set': {'bsclubinfo.message': str(message.id)}})
+            # the new message has no embed yet
+            self.clanstats_schedule.edited(g['guild_id'], None)
+            try:
+                await message.add_reaction(':refresh:477405504512065536')
+            except discord.HTTPException:
+                pass
 
-            if not message:
-                try:
-                    message = await self.bot.get_channel(int(m['channel'])).send('Clan Stats')
-                except AttributeError:
-                    await self.bot.mongo.find_one_and_delete({'guild_id': str(g['guild_id'])})
-                    break
+        digest = self.clanstats_schedule.changed(g['guild_id'], embed)
+        if digest is None:
+            datadog.statsd.increment('statsy.clanstats.unchanged', 1, ['game:brawlstars'])
+            return
 
-            await message.edit(content='', embed=embed)
-            return message
+        await message.edit(content='', embed=embed)
+        self.clanstats_schedule.edited(g['guild_id'], digest)
 
     async def on_raw_reaction_add(self, payload):
         data = await self.bot.mongo.config.guilds.find_one({'guild_id': str(payload.guild_id), 'bsclubinfo.message': str(payload.message_id)})
@@ -478,15 +562,27 @@ class Brawl_Stars:
             if member == self.bot.user:
                 return
 
-            message = await self.clanupdate(data)
+            self.clanstats_schedule.request(str(payload.guild_id), self.refresh_board, data, payload)
+
+    async def refresh_board(self, data, payload):
+        await self.clanupdate(data)
+        try:
+            message = await self.bot.get_channel(payload.channel_id).get_message(payload.message_id)
             await message.clear_reactions()
             await message.add_reaction(':refresh:477405504512065536')
+        except (AttributeError, discord.HTTPException):
+            pass
 
     async def clan_update_loop(self):
         await self.bot.wait_until_ready()
         while not self.bot.is_closed():
-            await self.clanupdate()
-            await asyncio.sleep(600)
+            guilds = await self.bot.mongo.config.guilds.find(
+                {'bsclubinfo': {'$exists': True}}, {'guild_id': 1, 'bsclubinfo': 1}
+            ).to_list(None)
+            due = self.clanstats_schedule.due(guilds)
+            if due:
+                await self.clanupdate(*due)
+            await asyncio.sleep(self.clanstats_schedule.tick)
 
 
 def setup(bot):
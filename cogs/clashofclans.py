@@ -1,3 +1,4 @@
+import asyncio
 import io
 import time
 import os
@@ -5,20 +6,27 @@ import os
 import aiohttp
 import datadog
 import discord
-from cachetools import TTLCache
 from discord.ext import commands
-from PIL import Image
 
 from ext import utils
+from ext.cache import APICache
 from ext.command import cog, command, group
 from ext.embeds import clashofclans
 from ext.paginator import Paginator
+from ext.render import RenderBusy, assets
 from locales.i18n import Translator
 
 _ = Translator('Clash of Clans', __file__)
 
 shortcuts = {}
 
+# (soft, hard) TTLs of the API cache in seconds, see ext.cache.APICache
+cache_policies = {
+    'players/{tag}': (180, 900),
+    'clans/{tag}': (180, 900),
+    'clans/{tag}/currentwar': (120, 600)
+}
+
 
 class TagCheck(commands.UserConverter):
 
@@ -67,57 +75,62 @@ class Clash_Of_Clans:
         self.bot = bot
         self.alias = 'coc'
         self.conv = TagCheck()
-        self.cache = TTLCache(500, 180)
+        self.cache = APICache(
+            bot.api_cache, 'clashofclans', cache_policies,
+            fallback=(aiohttp.ContentTypeError,)
+        )
 
     def __unload(self):
         self.bot.loop.create_task(self.session.close())
 
     async def __local_check(self, ctx):
         if isinstance(ctx.channel, discord.TextChannel):
-            guild_info = await self.bot.mongo.config.guilds.find_one({'guild_id': str(ctx.guild.id)}) or {}
+            guild_info = await self.bot.guild_config.get(ctx.guild.id)
             return guild_info.get('games', {}).get(self.__class__.__name__, True)
         else:
             return True
 
-    async def request(self, ctx, endpoint, *, reason='command'):
+    async def request(self, ctx, method, tag, *, reason='command'):
+        key = self.cache.key(method, tag)
+        endpoint = method.replace('{tag}', f'%23{key.tag or tag}')
         try:
-            self.cache[endpoint]
-        except KeyError:
-            speed = time.time()
-            async with self.bot.session.get(
-                f"http://{os.getenv('spike')}/redirect?url=https://api.clashofclans.com/v1/{endpoint}",
-                headers={'Authorization': f"Bearer {os.getenv('clashofclans')}"}
-            ) as resp:
-                speed = time.time() - speed
-                datadog.statsd.increment('statsy.api_latency', 1, [
-                    'game:clashofclans', f'speed:{speed}', f'method:{endpoint}'
-                ])
-                datadog.statsd.increment('statsy.requests', 1, [
-                    'game:clashofclans', f'code:{resp.status}', f'method:{endpoint}', f'reason:{reason}'
-                ])
-                try:
-                    self.cache[endpoint] = await resp.json()
-                except aiohttp.ContentTypeError:
-                    er = discord.Embed(
-                        title=_('Clash of Clans Server Down'),
-                        color=discord.Color.red(),
-                        description='This could be caused by a maintainence break.'
-                    )
-                    if ctx.bot.psa_message:
-                        er.add_field(name=_('Please Note!'), value=ctx.bot.psa_message)
-                    await ctx.send(embed=er)
-
-                    # end and ignore error
-                    raise commands.CheckFailure
-
-        if self.cache[endpoint] == {"reason": "notFound"}:
+            data = await self.cache.get(key, self._request, endpoint, reason)
+        except aiohttp.ContentTypeError:
+            er = discord.Embed(
+                title=_('Clash of Clans Server Down'),
+                color=discord.Color.red(),
+                description='This could be caused by a maintainence break.'
+            )
+            if ctx.bot.psa_message:
+                er.add_field(name=_('Please Note!'), value=ctx.bot.psa_message)
+            await ctx.send(embed=er)
+
+            # end and ignore error
+            raise commands.CheckFailure
+
+        if data == {"reason": "notFound"}:
             await ctx.send(_('The tag cannot be found!'))
             raise utils.NoTag
 
-        return self.cache[endpoint]
+        return data
+
+    async def _request(self, endpoint, reason):
+        speed = time.time()
+        async with self.bot.sessions.get('clashofclans').get(
+            f"http://{os.getenv('spike')}/redirect?url=https://api.clashofclans.com/v1/{endpoint}",
+            headers={'Authorization': f"Bearer {os.getenv('clashofclans')}"}
+        ) as resp:
+            speed = time.time() - speed
+            datadog.statsd.increment('statsy.api_latency', 1, [
+                'game:clashofclans', f'speed:{speed}', f'method:{endpoint}'
+            ])
+            datadog.statsd.increment('statsy.requests', 1, [
+                'game:clashofclans', f'code:{resp.status}', f'method:{endpoint}', f'reason:{reason}'
+            ])
+            return await resp.json()
 
     async def get_clan_from_profile(self, ctx, tag, message):
-        profile = await self.request(ctx, f'players/%23{tag}')
+        profile = await self.request(ctx, 'players/{tag}', tag)
         try:
             clan_tag = profile['clan']['tag']
         except KeyError:
@@ -162,7 +175,7 @@ class Clash_Of_Clans:
         tag = await self.resolve_tag(ctx, tag_or_user)
 
         async with ctx.typing():
-            profile = await self.request(ctx, f'players/%23{tag}')
+            profile = await self.request(ctx, 'players/{tag}', tag)
 
             ems = await clashofclans.format_profile(ctx, profile)
 
@@ -175,7 +188,7 @@ class Clash_Of_Clans:
         tag = await self.resolve_tag(ctx, tag_or_user)
 
         async with ctx.typing():
-            profile = await self.request(ctx, f'players/%23{tag}')
+            profile = await self.request(ctx, 'players/{tag}', tag)
 
             ems = await clashofclans.format_achievements(ctx, profile)
 
@@ -188,7 +201,7 @@ class Clash_Of_Clans:
         tag = await self.resolve_tag(ctx, tag_or_user, clan=True)
 
         async with ctx.typing():
-            clan = await self.request(ctx, f'clans/%23{tag}')
+            clan = await self.request(ctx, 'clans/{tag}', tag)
 
             ems = await clashofclans.format_clan(ctx, clan)
 
@@ -201,7 +214,7 @@ class Clash_Of_Clans:
         tag = await self.resolve_tag(ctx, tag_or_user, clan=True)
 
         async with ctx.typing():
-            clan = await self.request(ctx, f'clans/%23{tag}')
+            clan = await self.request(ctx, 'clans/{tag}', tag)
 
             ems = await clashofclans.format_members(ctx, clan)
 
@@ -214,7 +227,7 @@ class Clash_Of_Clans:
         tag = await self.resolve_tag(ctx, tag_or_user, clan=True)
 
         async with ctx.typing():
-            clan = await self.request(ctx, f'clans/%23{tag}')
+            clan = await self.request(ctx, 'clans/{tag}', tag)
 
             if clan['members'] < 4:
                 return await ctx.send(_('Clan must have at least than 4 players for these statistics.'))
@@ -229,7 +242,7 @@ class Clash_Of_Clans:
         tag = await self.resolve_tag(ctx, tag_or_user, clan=True)
 
         async with ctx.typing():
-            clan = await self.request(ctx, f'clans/%23{tag}')
+            clan = await self.request(ctx, 'clans/{tag}', tag)
 
             if clan['members'] < 4:
                 return await ctx.send(_('Clan must have at least than 4 players for these statistics.'))
@@ -278,39 +291,23 @@ class Clash_Of_Clans:
         """Check your current war status."""
         tag = await self.resolve_tag(ctx, tag_or_user, clan=True)
         async with ctx.typing():
-            war = await self.request(ctx, f'clans/%23{tag}/currentwar')
+            war = await self.request(ctx, 'clans/{tag}/currentwar', tag)
             if "reason" in war:
                 return await ctx.send(_("This clan's war logs aren't public."))
             if war['state'] == 'notInWar':
                 return await ctx.send(_("This clan isn't in a war right now!"))
 
-            async with ctx.session.get(war['clan']['badgeUrls']['large']) as resp:
-                clan_img = Image.open(io.BytesIO(await resp.read()))
-            async with ctx.session.get(war['opponent']['badgeUrls']['large']) as resp:
-                opp_img = Image.open(io.BytesIO(await resp.read()))
+            urls = [war['clan']['badgeUrls']['large'], war['opponent']['badgeUrls']['large']]
+            badges = await asyncio.gather(*(assets.fetch(ctx.session, f'badge:{u}', u, dynamic=True) for u in urls))
 
-            image = await self.bot.loop.run_in_executor(None, self.war_image, ctx, clan_img, opp_img)
             em = await clashofclans.format_war(ctx, war)
-            await ctx.send(file=discord.File(image, 'war.png'), embed=em)
-
-    def war_image(self, ctx, clan_img, opp_img):
-
-        bg_image = Image.open("data/war-bg.png")
-        size = bg_image.size
-
-        image = Image.new("RGBA", size)
-        image.paste(bg_image)
-
-        c_box = (60, 55, 572, 567)
-        image.paste(clan_img, c_box, clan_img)
-
-        o_box = (928, 55, 1440, 567)
-        image.paste(opp_img, o_box, opp_img)
-
-        file = io.BytesIO()
-        image.save(file, format="PNG")
-        file.seek(0)
-        return file
+            try:
+                image = await self.bot.render_pool.run('war', clashofclans.war_image, *badges)
+            except RenderBusy:
+                await ctx.send(embed=em)
+            else:
+                em.set_image(url=f"attachment://{self.bot.render_pool.filename('war')}")
+                await ctx.send(file=discord.File(io.BytesIO(image), self.bot.render_pool.filename('war')), embed=em)
 
 
 def setup(bot):
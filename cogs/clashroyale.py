@@ -1,11 +1,10 @@
 import asyncio
 import io
 import json
+import math
 import random
 import os
 import time
-from base64 import b64decode
-from collections import OrderedDict
 from datetime import datetime
 import traceback
 
@@ -13,18 +12,23 @@ import clashroyale
 import datadog
 import discord
 import requests
-from cachetools import TTLCache
+from cachetools import LRUCache
 from discord.ext import commands
-from oauth2client.service_account import ServiceAccountCredentials
-from pymongo import ReturnDocument
 
 from ext import utils
+from ext.cache import APICache, stale_since
+from ext.clanstats import BoardScheduler, board_results, fetch_clans
 from ext.context import NoContext
 from ext.command import cog, command, group
 from ext.utils import e
 from ext.embeds import clashroyale as cr
-from ext.paginator import Paginator
-from locales.i18n import Translator
+from ext.leaderboard import GuildMembers, LeaderboardImporter, LeaderboardStore
+from ext.paginator import LazyPaginator, Paginator
+from ext.prefetch import Prefetcher
+from ext.ratelimit import TokenBucket
+from ext.render import RenderBusy, assets
+from ext.tournaments import TournamentLog
+from locales.i18n import Translator, current_language
 
 _ = Translator('Clash Royale', __file__)
 
@@ -54,6 +58,21 @@ shortcuts = {
     'TIDEA': '2JPPGGJ0'
 }
 
+# (soft, hard) TTLs of the API cache in seconds, see ext.cache.APICache
+cache_policies = {
+    'get_player': (180, 900),
+    'get_player_chests': (180, 900),
+    'get_player_battles': (60, 300),
+    'get_clan': (180, 900),
+    'get_clan_war': (120, 600),
+    'get_clan_war_log': (600, 3600),
+    'get_top_players': (600, 3600),
+    'get_top_clans': (600, 3600),
+    'get_top_clanwar_clans': (600, 3600),
+    'get_tournament': (60, 300),
+    'get_open_tournaments': (60, 180)
+}
+
 
 class TagOnly(commands.Converter):
 
@@ -130,20 +149,30 @@ class Clash_Royale:
     def __init__(self, bot):
         self.bot = bot
         self.conv = TagCheck()
-        self.cache = TTLCache(500, 180)
-        scopes = [
-            "https://www.googleapis.com/auth/userinfo.email",
-            "https://www.googleapis.com/auth/firebase.database"
-        ]
-        self.firebase = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(b64decode(os.getenv('firebase')).decode()), scopes=scopes)
-
+        self.prefetcher = Prefetcher('clashroyale', cost=4)
+        self.clanstats_bucket = TokenBucket(rate=10, capacity=20)
+        self.clanstats_schedule = BoardScheduler()
+        self.tournament_log = TournamentLog(bot)
+        self.bot.loop.create_task(self.tournament_log.load())
+        self.leaderboard_store = LeaderboardStore(self.bot.mongo.config.leaderboard)
+        self.leaderboard_fed = LRUCache(10000)
+        self.bot.loop.create_task(self.leaderboard_store.create_indexes())
+        self.guild_players = GuildMembers()
+        self.bot.loop.create_task(self.guild_players.load(self.bot.mongo.player_tags.clashroyale))
+        self.cache = APICache(
+            bot.api_cache, 'clashroyale', cache_policies,
+            fallback=(clashroyale.RequestError,),
+            passthrough=(clashroyale.NotFoundError,),
+            dump=self.dump_response,
+            load=self.load_response
+        )
         try:
             constants = json.loads(requests.get('https://fourjr.herokuapp.com/cr/constants').text)
         except json.JSONDecodeError:
             constants = None
         self.cr = clashroyale.OfficialAPI(
             os.getenv('clashroyale'),
-            session=self.bot.session,
+            session=self.bot.sessions.get('clashroyale'),
             is_async=True,
             timeout=20,
             constants=constants,
@@ -151,17 +180,22 @@ class Clash_Royale:
         )
         self.royaleapi = clashroyale.RoyaleAPI(
             os.getenv('royaleapi'),
-            session=self.bot.session,
+            session=self.bot.sessions.get('clashroyale'),
             is_async=True,
             timeout=20
         )
 
+        self.bot.loop.create_task(assets.prefetch(self.bot.sessions.get('assets'), {
+            f'card:{c.key}': f'{cr.images}/{c.key}.png' for c in self.cr.constants.cards
+        }))
+
         if not self.bot.dev_mode:
             self.bot.clan_update = self.bot.loop.create_task(self.clan_update_loop())
+            self.leaderboard_import = self.bot.loop.create_task(self.leaderboard_import_loop())
 
     async def __local_check(self, ctx):
         if isinstance(ctx.channel, discord.TextChannel):
-            guild_info = await self.bot.mongo.config.guilds.find_one({'guild_id': str(ctx.guild.id)}) or {}
+            guild_info = await self.bot.guild_config.get(ctx.guild.id)
             return guild_info.get('games', {}).get(self.__class__.__name__, True)
         else:
             return True
@@ -183,40 +217,63 @@ class Clash_Royale:
     async def request(self, ctx, method, *args, **kwargs):
         client = kwargs.pop('client', self.cr)
         reason = kwargs.pop('reason', 'command')
-        try:
-            data = self.cache[f'{method}{args}{kwargs}']
-        except KeyError:
-            speed = time.time()
-            data = await getattr(client, method)(*args, **kwargs)
-            speed = time.time() - speed
-            self.cache[f'{method}{args}{kwargs}'] = data
-
-            if isinstance(data, list):
-                status_code = 'list'
-            else:
-                status_code = data.response.status
-
-            datadog.statsd.increment('statsy.requests', 1, [
-                'game:clashroyale', f'code:{status_code}', f'method:{method}', f'reason:{reason}'
-            ])
-            datadog.statsd.increment('statsy.api_latency', 1, [
-                'game:clashroyale', f'speed:{speed}', f'method:{method}'
-            ])
+        key = self.cache.key(method, *args, **kwargs)
+        return await self.cache.get(key, self._request, client, method, reason, *args, **kwargs)
+
+    async def request_many(self, ctx, *calls, **kwargs):
+        """Runs independent requests concurrently
+
+        Each call is a ``(method, *args)`` tuple and ``kwargs`` are passed
+        to all of them. Returns the results in order; the first error is
+        raised once while the other requests still complete and get cached.
+        """
+        async def request(call):
+            # each request runs in its own task, so its stale marker is returned
+            return await self.request(ctx, *call, **kwargs), stale_since.get()
+
+        results = await asyncio.gather(*(request(call) for call in calls))
+        stale = [created for value, created in results if created is not None]
+        stale_since.set(min(stale) if stale else None)
+        return [value for value, created in results]
+
+    async def _request(self, client, method, reason, *args, **kwargs):
+        speed = time.time()
+        data = await getattr(client, method)(*args, **kwargs)
+        speed = time.time() - speed
+
+        if isinstance(data, list):
+            status_code = 'list'
+        else:
+            status_code = data.response.status
+
+        datadog.statsd.increment('statsy.requests', 1, [
+            'game:clashroyale', f'code:{status_code}', f'method:{method}', f'reason:{reason}'
+        ])
+        datadog.statsd.increment('statsy.api_latency', 1, [
+            'game:clashroyale', f'speed:{speed}', f'method:{method}'
+        ])
         return data
 
-    async def request_db(self, **kwargs):
-        try:
-            return self.cache[f'LBDB{kwargs}']
-        except KeyError:
-            async with self.bot.session.request(
-                kwargs.get('method', 'GET'),
-                kwargs.get('url', 'https://statsy-fourjr.firebaseio.com/players.json'),
-                headers={'Authorization': f'Bearer {self.firebase.get_access_token().access_token}'},
-                json=kwargs.get('json', {}),
-                params=kwargs.get('params', {})
-            ) as resp:
-                self.cache[f'LBDB{kwargs}'] = await resp.json()
-                return self.cache[f'LBDB{kwargs}']
+    def dump_response(self, method, data):
+        """Converts a response to JSON for the second level cache"""
+        if isinstance(data, list) and not hasattr(data, 'client'):
+            # list of models
+            client = data[0].client if data else self.cr
+            data = [i.raw_data for i in data]
+        else:
+            client = data.client
+            if isinstance(data, clashroyale.official_api.models.PaginatedAttrDict):
+                data = {'items': [i.raw_data for i in data.raw_data], 'paging': {'cursors': data.cursor}}
+            elif not isinstance(data, list):
+                data = data.raw_data
+
+        return ['royaleapi' if client is self.royaleapi else 'official', data]
+
+    def load_response(self, method, payload, created):
+        """Rebuilds a response dumped by dump_response"""
+        api, data = payload
+        client = self.royaleapi if api == 'royaleapi' else self.cr
+        return client._convert_model(data, True, datetime.utcfromtimestamp(created), None, None)
 
     async def get_clan_from_profile(self, ctx, tag, message):
         p = await self.request(ctx, 'get_player', tag)
@@ -256,43 +313,11 @@ class Clash_Royale:
         else:
             return tag_or_user
 
-    async def tournament_sender(self, ctx, t_filter, em):
-        guilds = self.bot.mongo.config.guilds.find({'tournament.types': {'$in': t_filter}})
-        async for g in guilds:
-            guild = self.bot.get_guild(int(g['guild_id']))
-            if guild is None:
-                continue
-
-            mention = g['tournament']['mention']
-            change_permissions = False
-
-            try:
-                role = discord.utils.get(guild.roles, id=int(mention))
-            except ValueError:
-                # mention is @here or @everyone
-                role_mention = mention
-            except TypeError:
-                # mention is None
-                role_mention = None
-            else:
-                # since role is an actual role, check permissions
-                if not role.mentionable:
-                    await role.edit(mentionable=True)
-                    change_permissions = True
-                role_mention = role.mention
-
-            if role_mention:
-                fmt = _('{}, new tournament found!').format(role_mention)
-            else:
-                fmt = _('New tournament found!')
-            channel = guild.get_channel(int(g['tournament']['channel_id']))
-            if channel:
-                await channel.send(
-                    content=fmt,
-                    embed=em
-                )
-            if change_permissions:
-                await role.edit(mentionable=False)
+    @staticmethod
+    def tournament_content(mention):
+        if mention:
+            return _('{}, new tournament found!').format(mention)
+        return _('New tournament found!')
 
     async def on_message(self, m):
         await self.bot.wait_until_ready()
@@ -302,10 +327,6 @@ class Clash_Royale:
         if m.channel.id == 480017443314597899 and m.author.bot:
             ctx = await self.bot.get_context(m)
             ctx.force_cog = self
-            if isinstance(ctx.channel, discord.TextChannel):
-                ctx.language = (await self.bot.mongo.config.guilds.find_one({'guild_id': str(ctx.guild.id)}) or {}).get('language', 'messages')
-            else:
-                ctx.language = 'messages'
             try:
                 tournament = await self.request(ctx, 'get_tournament', m.content.split(' ')[0], reason='tournament_log')
             except clashroyale.RequestError:
@@ -315,10 +336,10 @@ class Clash_Royale:
                 except clashroyale.RequestError:
                     return
 
-            await self.tournament_sender(
-                ctx,
+            await self.tournament_log.send(
                 json.loads(' '.join(m.content.split(' ')[1:])),
-                (await cr.format_tournament(ctx, tournament))[0]
+                (await cr.format_tournament(ctx, tournament))[0],
+                self.tournament_content
             )
             return
 
@@ -326,7 +347,7 @@ class Clash_Royale:
             return
 
         # LINK
-        guild_config = await self.bot.mongo.config.guilds.find_one({'guild_id': str(m.guild.id)}) or {}
+        guild_config = await self.bot.guild_config.get(m.guild.id)
         friend_config = guild_config.get('friend_link')
 
         default = False
@@ -337,10 +358,6 @@ class Clash_Royale:
         if friend_config:
             ctx = await self.bot.get_context(m)
             ctx.force_cog = self
-            if isinstance(ctx.channel, discord.TextChannel):
-                ctx.language = (await self.bot.mongo.config.guilds.find_one({'guild_id': str(ctx.guild.id)}) or {}).get('language', 'messages')
-            else:
-                ctx.language = 'messages'
 
             deck = m.content[m.content.find('?deck=') + 6:m.content.find('?deck=') + 8 * 8 + 7 + 6].split(';')
 
@@ -404,34 +421,72 @@ class Clash_Royale:
 
                 await m.channel.send(text, embed=em)
 
+    async def on_member_join(self, member):
+        self.guild_players.member_join(member)
+
+    async def on_member_remove(self, member):
+        self.guild_players.member_remove(member)
+
+    async def on_guild_remove(self, guild):
+        self.guild_players.remove_guild(guild.id)
+        self.tournament_log.forget(guild.id)
+
+    async def on_guild_join(self, guild):
+        self.tournament_log.forget(guild.id)
+
+    async def on_guild_role_delete(self, role):
+        self.tournament_log.forget(role.guild.id)
+
+    async def on_guild_channel_delete(self, channel):
+        if self.tournament_log.is_channel(channel):
+            await self.bot.guild_config.update(channel.guild.id, {'$unset': {'tournament': ''}})
+
+    async def on_command(self, ctx):
+        if ctx.cog is self:
+            self.prefetcher.used(ctx.author.id)
+
     async def on_typing(self, channel, user, when):
+        if self.bot.is_closed() or user.bot or not self.prefetcher.check(user.id):
+            return
+
         ctx = NoContext(self.bot, user, channel=channel)
-        if self.bot.is_closed() or not await self.__local_check(ctx) or user.bot:
+        if not await self.__local_check(ctx):
             return
 
         if isinstance(ctx.channel, discord.TextChannel):
-            ctx.language = (await self.bot.mongo.config.guilds.find_one({'guild_id': str(ctx.guild.id)}) or {}).get('language', 'messages')
+            ctx.language = (await self.bot.guild_config.get(ctx.guild.id)).get('language', 'messages')
         else:
             ctx.language = 'messages'
+        current_language.set(ctx.language)
 
         guild_id = getattr(ctx.guild, 'id', 'DM')
         try:
             datadog.statsd.increment('statsy.magic_caching.check', 1, [f'user:{user.id}', f'guild:{guild_id}', 'game:clashroyale'])
             tag = await self.resolve_tag(ctx, None)
+            if not self.prefetcher.spend():
+                return
 
             try:
-                player = await self.request(ctx, 'get_player', tag, reason='magic caching')
+                player, cycle = await self.request_many(
+                    ctx, ('get_player', tag), ('get_player_chests', tag), reason='magic caching'
+                )
             except ValueError:
                 return
 
             datadog.statsd.increment('statsy.magic_caching.request', 1, [f'user:{user.id}', f'guild:{guild_id}', 'game:clashroyale'])
 
-            await self.request(ctx, 'get_player_chests', tag)
+            # keeps the leaderboard current, once per fetched player
+            key = f'{user.id}-{tag}'
+            if self.leaderboard_fed.get(key) is not player:
+                self.leaderboard_fed[key] = player
+                await self.leaderboard_store.update(key, player.raw_data)
+
             try:
-                await self.request(ctx, 'get_clan', player.clan.tag, reason='magic caching')
-                await self.request(ctx, 'get_clan_war', player.clan.tag, reason='magic caching')
+                clan_tag = player.clan.tag
             except AttributeError:
                 pass
+            else:
+                await self.request_many(ctx, ('get_clan', clan_tag), ('get_clan_war', clan_tag), reason='magic caching')
         except (utils.NoTag, clashroyale.RequestError):
             pass
 
@@ -439,7 +494,7 @@ class Clash_Royale:
     @group()
     async def link(self, ctx):
         """Check your guild's link beautifier status"""
-        guild_config = await self.bot.mongo.config.guilds.find_one({'guild_id': str(ctx.guild.id)}) or {}
+        guild_config = await self.bot.guild_config.get(ctx.guild.id)
         friend_config = guild_config.get('friend_link')
 
         default = False
@@ -457,9 +512,7 @@ class Clash_Royale:
     @link.command()
     async def enable(self, ctx):
         """Enables link beautifier"""
-        await self.bot.mongo.config.guilds.find_one_and_update(
-            {'guild_id': str(ctx.guild.id)}, {'$set': {'friend_link': True}}, upsert=True
-        )
+        await self.bot.guild_config.update(ctx.guild.id, {'$set': {'friend_link': True}})
         await ctx.send(_('Successfully set link beautifier to be enabled.'))
 
     @commands.guild_only()
@@ -467,9 +520,7 @@ class Clash_Royale:
     @link.command()
     async def disable(self, ctx):
         """Disables link beautifier"""
-        await self.bot.mongo.config.guilds.find_one_and_update(
-            {'guild_id': str(ctx.guild.id)}, {'$set': {'friend_link': False}}, upsert=True
-        )
+        await self.bot.guild_config.update(ctx.guild.id, {'$set': {'friend_link': False}})
         await ctx.send(_('Successfully set link beautifier to be disabled.'))
 
     @commands.guild_only()
@@ -512,15 +563,13 @@ class Clash_Royale:
         except asyncio.TimeoutError:
             return await ctx.send('Command timeout. Do the command again to restart the process.')
 
-        await self.bot.mongo.config.guilds.find_one_and_update(
-            {'guild_id': str(ctx.guild.id)}, {'$set': {
-                'tournament': {
-                    'channel_id': str(channel),
-                    'mention': role,
-                    'types': types
-                }
-            }}, upsert=True
-        )
+        await self.bot.guild_config.update(ctx.guild.id, {'$set': {
+            'tournament': {
+                'channel_id': str(channel),
+                'mention': role,
+                'types': types
+            }
+        }})
         await ctx.send(_('Log set!'))
 
     @commands.has_permissions(manage_guild=True)
@@ -552,7 +601,7 @@ class Clash_Royale:
 
             try:
                 # Update existing config
-                config = await self.bot.mongo.config.guilds.find_one({'guild_id': str(ctx.guild.id)}) or {}
+                config = await self.bot.guild_config.get(ctx.guild.id)
                 message = None
                 message_id = config.get('claninfo', {}).get('message')
                 if message_id:
@@ -576,14 +625,15 @@ class Clash_Royale:
                     pass
                 return await ctx.send(_('Statsy should have permissions to `Send Messages` and `Add Reactions` in #{}').format(channel.name))
 
-            data = await self.bot.mongo.config.guilds.find_one_and_update({'guild_id': str(ctx.guild.id)}, {'$set': {
+            data = await self.bot.guild_config.update(ctx.guild.id, {'$set': {
                 'claninfo': {
                     'channel': str(channel.id),
                     'message': str(message.id),
                     'clans': clans
                 }
-            }}, upsert=True, return_document=ReturnDocument.AFTER)
+            }})
 
+            self.clanstats_schedule.forget(data['guild_id'])
             await self.clanupdate(data)
             await ctx.send(_('Configuration complete.'))
 
@@ -594,8 +644,7 @@ class Clash_Royale:
         tag = await self.resolve_tag(ctx, tag_or_user[0], index=tag_or_user[1])
 
         async with ctx.typing():
-            profile = await self.request(ctx, 'get_player', tag)
-            cycle = await self.request(ctx, 'get_player_chests', tag)
+            profile, cycle = await self.request_many(ctx, ('get_player', tag), ('get_player_chests', tag))
             em = await cr.format_profile(ctx, profile, cycle)
 
         await ctx.send(embed=em)
@@ -634,8 +683,7 @@ class Clash_Royale:
         tag = await self.resolve_tag(ctx, tag_or_user[0], index=tag_or_user[1])
 
         async with ctx.typing():
-            profile = await self.request(ctx, 'get_player', tag)
-            cycle = await self.request(ctx, 'get_player_chests', tag)
+            profile, cycle = await self.request_many(ctx, ('get_player', tag), ('get_player_chests', tag))
             em = await cr.format_chests(ctx, profile, cycle)
 
         await ctx.send(embed=em)
@@ -693,43 +741,37 @@ class Clash_Royale:
     async def leaderboard(self, ctx, option=None):
         await ctx.invoke(self.bot.get_command('help'), command=str(ctx.command))
 
-    async def parse_leaderboard(self, ctx, emoji_name, *statistics, **kwargs):
-        async with ctx.typing():
-            if not ctx.guild:
-                return await ctx.send('This command can only be run in servers.')
+    async def parse_leaderboard(self, ctx, emoji_name, statistic, **kwargs):
+        if not ctx.guild:
+            return await ctx.send('This command can only be run in servers.')
 
-            db_result = await self.request_db()
+        async with ctx.typing():
+            user_ids = self.guild_players.get(ctx.guild)
+            count = await self.leaderboard_store.count(statistic, user_ids)
 
-            def predicate(x):
-                result = db_result[x]
-                for i in statistics:
-                    result = result[i]
-                return result
+            tag = await self.resolve_tag(ctx, ctx.author)
+            rank = await self.leaderboard_store.rank(statistic, user_ids, f'{ctx.author.id}-{tag}')
 
-            data = sorted(db_result, key=predicate, reverse=True)
-            sorted_result = OrderedDict()
-            for i in data:
-                sorted_result[i] = db_result[i]
+            nearby = []
+            if rank is not None:
+                nearby = await self.leaderboard_store.page(statistic, user_ids, max(rank - 2, 0), 5 - max(2 - rank, 0))
 
-            tag = await self.resolve_tag(ctx, ctx.author)
-            ems = await cr.format_lb(ctx, sorted_result, tag, emoji_name, *statistics, **kwargs)
+            color = utils.random_color()
 
-            del db_result
-            del data
-            del sorted_result
+            async def get_page(page):
+                players = await self.leaderboard_store.page(statistic, user_ids, page * 10, 10)
+                return cr.format_lb(ctx, players, page * 10, emoji_name, statistic, nearby, rank, color=color, **kwargs)
 
         try:
-            await Paginator(ctx, *ems).start()
+            await LazyPaginator(ctx, math.ceil(count / 10), get_page).start()
         except SyntaxError:
             await ctx.send('Unable to retrieve leaderboard')
 
-        del ems
-
     @utils.has_perms()
     @leaderboard.command()
     async def clansjoined(self, ctx):
         """Gets the leaderboard of XP Level"""
-        await self.parse_leaderboard(ctx, 'clan', 'achievements', 0, 'value', name='Clans Joined')
+        await self.parse_leaderboard(ctx, 'clan', 'clansJoined', name='Clans Joined')
 
     @utils.has_perms()
     @leaderboard.command(aliases=['donation'])
@@ -834,8 +876,7 @@ class Clash_Royale:
         tag = await self.resolve_tag(ctx, tag_or_user[0], index=tag_or_user[1], clan=True)
 
         async with ctx.typing():
-            clan = await self.request(ctx, 'get_clan', tag)
-            war = await self.request(ctx, 'get_clan_war_log', tag)
+            clan, war = await self.request_many(ctx, ('get_clan', tag), ('get_clan_war_log', tag))
 
             ems = await cr.format_members(ctx, clan, war)
 
@@ -848,8 +889,7 @@ class Clash_Royale:
         tag = await self.resolve_tag(ctx, tag_or_user[0], index=tag_or_user[1], clan=True)
 
         async with ctx.typing():
-            clan = await self.request(ctx, 'get_clan', tag)
-            war = await self.request(ctx, 'get_clan_war_log', tag)
+            clan, war = await self.request_many(ctx, ('get_clan', tag), ('get_clan_war_log', tag))
 
             if len(clan.member_list) < 4:
                 await ctx.send('Clan must have at least 4 players for these statistics.')
@@ -864,8 +904,7 @@ class Clash_Royale:
         tag = await self.resolve_tag(ctx, tag_or_user[0], index=tag_or_user[1], clan=True)
 
         async with ctx.typing():
-            clan = await self.request(ctx, 'get_clan', tag)
-            war = await self.request(ctx, 'get_clan_war_log', tag)
+            clan, war = await self.request_many(ctx, ('get_clan', tag), ('get_clan_war_log', tag))
 
             if len(clan.member_list) < 4:
                 return await ctx.send('Clan must have at least 4 players for these statistics.')
@@ -885,6 +924,8 @@ class Clash_Royale:
             player = await self.request(ctx, 'get_player', tag[0])
             player.raw_data['timestamp'] = time.time()
             await ctx.save_tag(tag[0], 'clashroyale', index=index.replace('-', ''))
+            await self.leaderboard_store.update(f'{ctx.author.id}-{tag[0]}', player.raw_data)
+            self.guild_players.save(ctx.author.id, self.bot)
 
             try:
                 default_game = self.bot.default_game[ctx.guild.id]
@@ -921,8 +962,9 @@ class Clash_Royale:
             profile = await self.request(ctx, 'get_player', tag)
             try:
                 await cr.format_deck_image_and_send(ctx, profile)
-            except Exception:
-                traceback.print_exc()
+            except Exception as error:
+                if not isinstance(error, RenderBusy):
+                    traceback.print_exc()
                 em = await cr.format_deck(ctx, profile)
                 await ctx.send(embed=em)
 
@@ -934,8 +976,9 @@ class Clash_Royale:
             rand_deck = random.sample(self.cr.constants.cards, 8)
             try:
                 await cr.format_random_deck_image_and_send(ctx, rand_deck)
-            except Exception:
-                traceback.print_exc()
+            except Exception as error:
+                if not isinstance(error, RenderBusy):
+                    traceback.print_exc()
                 em = await cr.format_random_deck(ctx, rand_deck)
                 await ctx.send(embed=em)
 
@@ -966,7 +1009,7 @@ class Clash_Royale:
 
         em = await cr.format_card(ctx, found_card)
         try:
-            async with self.bot.session.get(e(card).url) as resp:
+            async with self.bot.sessions.get('assets').get(e(card).url) as resp:
                 c = io.BytesIO(await resp.read())
         except AttributeError:
             # new card, no emoji
@@ -994,53 +1037,97 @@ class Clash_Royale:
 
         await ctx.send(embed=em)
 
-    async def get_clans(self, *tags):
-        clans = []
-        wars = []
-        for t in tags:
-            clans.append(await self.request(None, 'get_clan', t, reason='clanstats'))
-            wars.append(await self.request(None, 'get_clan_war', t, reason='clanstats'))
-            await asyncio.sleep(0.5)
-        return clans, wars
-
-    async def clanupdate(self, clan=None):
-        if not clan:
+    async def get_clan_stats(self, tag):
+        return await asyncio.gather(
+            self.request(None, 'get_clan', tag, reason='clanstats'),
+            self.request(None, 'get_clan_war', tag, reason='clanstats')
+        )
+
+    async def clanupdate(self, *guilds):
+        """Refreshes the clan stats board of a guild config, or of every guild
+
+        Clans shared by several boards are only fetched once.
+        """
+        if not guilds:
             guilds = await self.bot.mongo.config.guilds.find({'claninfo': {'$exists': True}}).to_list(None)
-        else:
-            guilds = [clan]
+
+        tags = [t for g in guilds for t in g['claninfo']['clans']]
+        results = await fetch_clans('clashroyale', tags, self.get_clan_stats, self.clanstats_bucket, cost=2)
 
         for g in guilds:
-            m = g['claninfo']
-            clans, wars = await self.get_clans(*m['clans'])
+            try:
+                await self.update_clan_board(g, results)
+            except discord.HTTPException:
+                pass
+
+    async def update_clan_board(self, g, results):
+        m = g['claninfo']
+        stats = board_results(m['clans'], results)
+        if not stats:
+            return
+
+        embed = discord.Embed(title="Clan Statistics!", color=0xf1c40f, timestamp=datetime.utcnow())
+        total_members = 0
 
-            embed = discord.Embed(title="Clan Statistics!", color=0xf1c40f, timestamp=datetime.utcnow())
-            total_members = 0
+        for clan, war in stats:
+            embed.add_field(name=clan.name, value=cr.format_clan_stats(clan, war))
+            total_members += len(clan.member_list)
 
-            for i in range(len(clans)):
-                embed.add_field(name=clans[i].name, value=cr.format_clan_stats(clans[i], wars[i]))
-                total_members += len(clans[i].member_list)
+        embed.add_field(name='More Info', value=f"<:clan:376373812012384267> {total_members}/{50*len(stats)}", inline=False)
+        try:
+            channel = self.bot.get_channel(int(m['channel']))
+            message = await channel.get_message(int(m['message']))
+        except (AttributeError, discord.NotFound):
+            message = None
 
-            embed.add_field(name='More Info', value=f"<:clan:376373812012384267> {total_members}/{50*len(clans)}", inline=False)
+        if not message:
             try:
-                channel = self.bot.get_channel(int(m['channel']))
-                message = await channel.get_message(int(m['message']))
+                message = await self.bot.get_channel(int(m['channel'])).send('Clan Stats')
             except AttributeError:
-                message = None
+                await self.bot.guild_config.update(g['guild_id'], {'$unset': {'claninfo': ''}})
+                return
+            await self.bot.guild_config.update(g['guild_id'], {'$set': {'claninfo.message': str(message.id)}})
+            # the new message has no embed yet
+            self.clanstats_schedule.edited(g['guild_id'], None)
+            try:
+                await message.add_reaction(':refresh:477405504512065536')
+            except discord.HTTPException:
+                pass
 
-            if not message:
-                try:
-                    message = await self.bot.get_channel(m['channel']).send('Clan Stats')
-                except AttributeError:
-                    await self.bot.mongo.find_one_and_delete({'guild_id': str(g['guild_id'])})
-                    break
-            await message.edit(content='', embed=embed)
-            return message
+        digest = self.clanstats_schedule.changed(g['guild_id'], embed)
+        if digest is None:
+            datadog.statsd.increment('statsy.clanstats.unchanged', 1, ['game:clashroyale'])
+            return
+
+        await message.edit(content='', embed=embed)
+        self.clanstats_schedule.edited(g['guild_id'], digest)
 
     async def clan_update_loop(self):
         await self.bot.wait_until_ready()
         while not self.bot.is_closed():
-            await self.clanupdate()
-            await asyncio.sleep(600)
+            guilds = await self.bot.mongo.config.guilds.find(
+                {'claninfo': {'$exists': True}}, {'guild_id': 1, 'claninfo': 1}
+            ).to_list(None)
+            due = self.clanstats_schedule.due(guilds)
+            if due:
+                await self.clanupdate(*due)
+            await asyncio.sleep(self.clanstats_schedule.tick)
+
+    async def leaderboard_import_loop(self):
+        async def fetch(tag):
+            return await self.request(None, 'get_player', tag, reason='leaderboard')
+
+        importer = LeaderboardImporter(
+            self.leaderboard_store, self.bot.mongo.player_tags.clashroyale, fetch, TokenBucket(rate=2, capacity=10)
+        )
+        await self.bot.wait_until_ready()
+        while not self.bot.is_closed():
+            started = time.time()
+            try:
+                await importer.run()
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(max(0, 3600 - (time.time() - started)))
 
     async def on_raw_reaction_add(self, payload):
         data = await self.bot.mongo.config.guilds.find_one({'guild_id': str(payload.guild_id), 'claninfo.message': str(payload.message_id)})
@@ -1050,9 +1137,16 @@ class Clash_Royale:
             if member == self.bot.user:
                 return
 
-            message = await self.clanupdate(data)
+            self.clanstats_schedule.request(str(payload.guild_id), self.refresh_board, data, payload)
+
+    async def refresh_board(self, data, payload):
+        await self.clanupdate(data)
+        try:
+            message = await self.bot.get_channel(payload.channel_id).get_message(payload.message_id)
             await message.clear_reactions()
             await message.add_reaction(':refresh:477405504512065536')
+        except (AttributeError, discord.HTTPException):
+            pass
 
 
 def setup(bot):
@@ -36,21 +36,15 @@ class Fortnite:
     def __init__(self, bot):
         self.bot = bot
         self.alias = 'fn'
-        bot.loop.create_task(self.__ainit__())
-
-    async def __ainit__(self):
-        self.session = aiohttp.ClientSession(loop=self.bot.loop)
+        self.session = bot.sessions.get('fortnite')
 
     async def __local_check(self, ctx):
         if isinstance(ctx.channel, discord.TextChannel):
-            guild_info = await self.bot.mongo.config.guilds.find_one({'guild_id': str(ctx.guild.id)}) or {}
+            guild_info = await self.bot.guild_config.get(ctx.guild.id)
             return guild_info.get('games', {}).get(self.__class__.__name__, True)
         else:
             return True
 
-    def __unload(self):
-        self.bot.loop.create_task(self.session.close())
-
     async def resolve_username(self, ctx, username, platform):
         if not username:
             try:
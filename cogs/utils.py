@@ -87,13 +87,9 @@ class Bot_Related:
         if not ctx.guild:
             return await ctx.send("Changing prefix isn't allowed in DMs")
         if prefix == '!':
-            await self.bot.mongo.config.guilds.find_one_and_delete(
-                {'guild_id': str(ctx.guild.id)}
-            )
+            await self.bot.guild_config.delete(ctx.guild.id)
         else:
-            await self.bot.mongo.config.guilds.find_one_and_update(
-                {'guild_id': str(ctx.guild.id)}, {'$set': {'prefix': str(prefix)}}, upsert=True
-            )
+            await self.bot.guild_config.update(ctx.guild.id, {'$set': {'prefix': str(prefix)}})
         await ctx.send(_('Changed the prefix to: `{}`').format(prefix))
 
     @command(name='bot', aliases=['about', 'info', 'botto'])
@@ -491,9 +487,7 @@ Total                   :  {len(self.bot.guilds)}```"""))
         if not language or language.lower() not in languages:
             await ctx.send(_('Available languages: {}').format(', '.join([i.title() for i in languages.keys()])))
         else:
-            await self.bot.mongo.config.guilds.find_one_and_update(
-                {'guild_id': str(ctx.guild.id)}, {'$set': {'language': languages[language.lower()]}}, upsert=True
-            )
+            await self.bot.guild_config.update(ctx.guild.id, {'$set': {'language': languages[language.lower()]}})
             await ctx.send(_('Language set.'))
 
     @command()
@@ -516,9 +510,7 @@ Total                   :  {len(self.bot.guilds)}```"""))
             await ctx.send(_('Invalid game. Pick from: {}').format(', '.join(shortcuts.keys())))
         else:
             cog_name = cog.__class__.__name__
-            await self.bot.mongo.config.guilds.find_one_and_update(
-                {'guild_id': str(ctx.guild.id)}, {'$set': {f'games.{cog_name}': True}}, upsert=True
-            )
+            await self.bot.guild_config.update(ctx.guild.id, {'$set': {f'games.{cog_name}': True}})
             await ctx.send('Successfully enabled {}'.format(' '.join(cog_name.split('_'))))
 
     @command()
@@ -541,9 +533,7 @@ Total                   :  {len(self.bot.guilds)}```"""))
             await ctx.send(_('Invalid game. Pick from: {}').format(', '.join(shortcuts.keys())))
         else:
             cog_name = cog.__class__.__name__
-            await self.bot.mongo.config.guilds.find_one_and_update(
-                {'guild_id': str(ctx.guild.id)}, {'$set': {f'games.{cog_name}': False}}, upsert=True
-            )
+            await self.bot.guild_config.update(ctx.guild.id, {'$set': {f'games.{cog_name}': False}})
             await ctx.send('Successfully disabled {}'.format(' '.join(cog_name.split('_'))))
 
     @command()
@@ -568,9 +558,7 @@ Total                   :  {len(self.bot.guilds)}```"""))
             await ctx.send(_('Invalid game. Pick from: {}').format(', '.join(shortcuts.keys())))
         else:
             cog_name = cog.__class__.__name__
-            await self.bot.mongo.config.guilds.find_one_and_update(
-                {'guild_id': guild_id}, {'$set': {'default_game': cog_name}}, upsert=True
-            )
+            await self.bot.guild_config.update(guild_id, {'$set': {'default_game': cog_name}})
             await ctx.send('Successfully set `{}` as the default game.'.format(' '.join(cog_name.split('_'))))
             self.bot.default_game[ctx.guild.id] = cog_name
 
@@ -613,9 +601,7 @@ Total                   :  {len(self.bot.guilds)}```"""))
                     break
 
             if language in _.translations.keys():
-                await self.bot.mongo.config.guilds.find_one_and_update(
-                    {'guild_id': str(g.id)}, {'$set': {'language': language}}, upsert=True
-                )
+                await self.bot.guild_config.update(g.id, {'$set': {'language': language}})
         else:
             language = 'en'
 
@@ -629,6 +615,7 @@ Total                   :  {len(self.bot.guilds)}```"""))
         datadog.statsd.increment('statsy.joined', 1)
 
     async def on_guild_remove(self, g):
+        self.bot.guild_config.invalidate(g.id)
         em = discord.Embed(
             title=f'Removed from {g.name} ({g.id})',
             description=f'{len(g.members)} members',
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+try:
+    import aioredis
+except ImportError:
+    aioredis = None
+
+
+def dumps(created, payload):
+    """Serializes a cache entry into compressed compact JSON"""
+    return zlib.compress(json.dumps([created, payload], separators=(',', ':')).encode())
+
+
+def loads(data):
+    """Returns the ``(created, payload)`` of a serialized cache entry"""
+    created, payload = json.loads(zlib.decompress(data).decode())
+    return created, payload
+
+
+class CacheBackend(ABC):
+    """Second level cache shared between processes and restarts
+
+    Backends only store bytes, ``APICache`` takes care of
+    serializing responses.
+    """
+
+    @abstractmethod
+    async def get(self, key):
+        """Returns the bytes stored under ``key`` or None"""
+
+    @abstractmethod
+    async def set(self, key, data, ttl):
+        """Stores ``data`` under ``key`` for ``ttl`` seconds"""
+
+    async def close(self):
+        pass
+
+
+class RedisBackend(CacheBackend):
+    """Stores entries in redis, connects on first use"""
+
+    def __init__(self, url):
+        if aioredis is None:
+            raise RuntimeError('aioredis is required for the redis cache backend')
+        self.url = url
+        self.redis = None
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        async with self.lock:
+            if self.redis is None:
+                self.redis = await aioredis.create_redis_pool(self.url)
+        return self.redis
+
+    async def get(self, key):
+        redis = self.redis or await self.connect()
+        return await redis.get(key)
+
+    async def set(self, key, data, ttl):
+        redis = self.redis or await self.connect()
+        await redis.set(key, data, expire=int(ttl))
+
+    async def close(self):
+        if self.redis is not None:
+            self.redis.close()
+            await self.redis.wait_closed()
+
+
+class SQLiteBackend(CacheBackend):
+    """Stores entries in a sqlite file, for local runs and tests
+
+    Queries run on a single worker thread so they never
+    block the event loop or share the connection.
+    """
+
+    def __init__(self, path, *, cleanup_every=500):
+        self.path = path
+        self.cleanup_every = cleanup_every
+        self.writes = 0
+        self.executor = ThreadPoolExecutor(1)
+        self.db = None
+
+    def _connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL, data BLOB)')
+        return self.db
+
+    def _get(self, key):
+        row = self._connect().execute(
+            'SELECT data FROM cache WHERE key = ? AND expires > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key, data, ttl):
+        db = self._connect()
+        with db:
+            db.execute('REPLACE INTO cache VALUES (?, ?, ?)', (key, time.time() + ttl, data))
+            self.writes += 1
+            if self.writes % self.cleanup_every == 0:
+                db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+
+    def _close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def run(self, func, *args):
+        return asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    async def get(self, key):
+        return await self.run(self._get, key)
+
+    async def set(self, key, data, ttl):
+        await self.run(self._set, key, data, ttl)
+
+    async def close(self):
+        await self.run(self._close)
+        self.executor.shutdown(wait=False)
+
+
+def from_url(url):
+    """Returns the backend configured by ``url``, None if there is none
+
+    ``redis://host:port/db`` uses redis and ``sqlite:///path`` a sqlite file.
+    """
+    if not url:
+        return None
+
+    parsed = urlparse(url)
+    if parsed.scheme in ('redis', 'rediss'):
+        return RedisBackend(url)
+    if parsed.scheme == 'sqlite':
+        return SQLiteBackend(os.path.abspath(parsed.netloc + parsed.path))
+    raise ValueError(f'Unknown cache backend: {parsed.scheme}')
@@ -0,0 +1,309 @@
+import asyncio
+import contextvars
+import re
+import sys
+import time
+from collections import namedtuple
+
+import datadog
+from cachetools import LRUCache
+
+from ext import backends
+
+# creation time of the response of the last APICache.get when it was stale, None
+# when it was fresh; read by CustomContext.send
+stale_since = contextvars.ContextVar('stale_since', default=None)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls sharing a key into one call
+
+    The first caller starts the call, every caller that arrives
+    while it is in flight awaits the same future.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.calls = {}
+
+    async def run(self, key, func, *args, **kwargs):
+        try:
+            task = self.calls[key]
+        except KeyError:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self.calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            datadog.statsd.increment('statsy.requests.coalesced', 1, [f'game:{self.game}'])
+
+        # a cancelled caller should not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # marks the exception as retrieved if every caller went away
+            task.exception()
+
+    def __len__(self):
+        return len(self.calls)
+
+
+TAG_RE = re.compile(r'[0289PYLQGRJCUV]+')
+
+
+def normalize_tag(tag):
+    """Returns the canonical form of a tag, None if ``tag`` is not one"""
+    tag = tag.strip().lstrip('#').upper().replace('O', '0')
+    if TAG_RE.fullmatch(tag):
+        return tag
+
+
+def freeze(obj):
+    """Returns a hashable version of a JSON like object"""
+    if isinstance(obj, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in obj.items()))
+    if isinstance(obj, list):
+        return tuple(freeze(i) for i in obj)
+    return obj
+
+
+class CacheKey(namedtuple('CacheKey', 'game method tag params')):
+    """Identifies an API response
+
+    Tags are normalized so ``'#abc'`` and ``'ABC'`` make the same key.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def make(cls, game, method, *args, **kwargs):
+        tag = None
+        if args and isinstance(args[0], str):
+            tag = normalize_tag(args[0])
+            if tag is not None:
+                args = args[1:]
+
+        if kwargs:
+            args += freeze(kwargs)
+        return cls(game, method, tag, args)
+
+    def __str__(self):
+        return f'{self.game}:{self.method}:{self.tag or ""}:{self.params}'
+
+
+def approximate_size(obj):
+    """Approximates the memory used by an API response in bytes"""
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if not isinstance(obj, (dict, list, tuple, str, int, float)) and hasattr(obj, 'raw_data'):
+            # models of the game API libraries keep their JSON and a Box copy of it
+            size += sys.getsizeof(obj)
+            stack.append(obj.raw_data)
+            boxed = getattr(obj, '_boxed_data', None)
+            if boxed is not None:
+                stack.append(boxed)
+            continue
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+    return size
+
+
+class CacheEntry:
+    __slots__ = ('value', 'created', 'size')
+
+    def __init__(self, value, created=None):
+        self.value = value
+        self.created = created or time.time()
+        self.size = approximate_size(value)
+
+    @property
+    def age(self):
+        return time.time() - self.created
+
+
+class CacheNamespace(LRUCache):
+    """LRU of cache entries bounded by their size in bytes"""
+
+    def __init__(self, name, quota):
+        super().__init__(quota, getsizeof=lambda entry: entry.size)
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+
+class ResponseCache:
+    """Game API responses of every cog
+
+    Each game gets its own namespace with a byte quota so
+    a burst of large leaderboards in one game cannot evict
+    the players of another.
+    """
+
+    def __init__(self, quotas, *, default_quota=16 * 1024**2, backend=None):
+        self.quotas = quotas
+        self.backend = backend
+        self.default_quota = default_quota
+        self.namespaces = {}
+
+    def namespace(self, name):
+        try:
+            return self.namespaces[name]
+        except KeyError:
+            namespace = CacheNamespace(name, self.quotas.get(name, self.default_quota))
+            self.namespaces[name] = namespace
+            return namespace
+
+    @property
+    def currsize(self):
+        return sum(i.currsize for i in self.namespaces.values())
+
+
+class APICache:
+    """Stale-while-revalidate cache for game API responses
+
+    Parameters
+    ----------
+    store: ResponseCache
+        The shared cache, entries go in the namespace of ``game``.
+    game: str
+        Namespace of the entries, also used to tag metrics.
+    policies: dict
+        Maps a method name to its ``(soft, hard)`` TTL in seconds.
+        Younger than ``soft``, the cached value is served. Between
+        ``soft`` and ``hard``, the stale value is served and refreshed
+        in the background. Past ``hard``, the value is refetched, but
+        the stale value is still served if that fails with one of
+        ``fallback``.
+    fallback: tuple
+        Upstream errors that should serve stale data instead.
+    passthrough: tuple
+        Subclasses of ``fallback`` that should always be raised.
+    dump: Callable[[str, Any], Any]
+        Converts the response of a method to JSON for the second
+        level cache of ``store``. Responses are stored as is by default.
+    load: Callable[[str, Any, float], Any]
+        Rebuilds a response from the output of ``dump`` and
+        the timestamp at which it was fetched.
+    """
+
+    def __init__(self, store, game, policies, *, default=(180, 180), fallback=(), passthrough=(), dump=None, load=None):
+        self.game = game
+        self.backend = store.backend
+        self.dump = dump or (lambda method, value: value)
+        self.load = load or (lambda method, payload, created: payload)
+        self.policies = policies
+        self.default = default
+        self.fallback = fallback + (asyncio.TimeoutError,)
+        self.passthrough = passthrough
+        self.entries = store.namespace(game)
+        self.inflight = SingleFlight(game)
+
+    def key(self, method, *args, **kwargs):
+        """Returns the key of a request to ``method``"""
+        return CacheKey.make(self.game, method, *args, **kwargs)
+
+    async def get(self, key, func, *args, **kwargs):
+        """Returns the cached value of ``key``, calling ``func`` when needed"""
+        soft, hard = self.policies.get(key.method, self.default)
+        entry = self.entries.get(key)
+        if entry is None and self.backend is not None:
+            entry = await self._load(key)
+
+        if entry is not None:
+            age = entry.age
+            if age < soft:
+                self.entries.hits += 1
+                stale_since.set(None)
+                return entry.value
+            if age < hard:
+                self.entries.hits += 1
+                self.refresh(key, func, *args, **kwargs)
+                stale_since.set(entry.created)
+                return entry.value
+
+        self.entries.misses += 1
+        try:
+            value = await self.inflight.run(key, self._fetch, key, func, *args, **kwargs)
+        except self.fallback as e:
+            if entry is None or isinstance(e, self.passthrough):
+                raise
+            datadog.statsd.increment('statsy.cache.stale', 1, [f'game:{self.game}', f'method:{key.method}'])
+            stale_since.set(entry.created)
+            return entry.value
+
+        stale_since.set(None)
+        return value
+
+    def refresh(self, key, func, *args, **kwargs):
+        """Refetches ``key`` in the background"""
+        if key not in self.inflight.calls:
+            asyncio.ensure_future(self._refresh(key, func, *args, **kwargs))
+
+    async def _refresh(self, key, func, *args, **kwargs):
+        try:
+            await self.inflight.run(key, self._fetch, key, func, *args, **kwargs)
+        except Exception:
+            datadog.statsd.increment('statsy.cache.refresh_failed', 1, [f'game:{self.game}'])
+
+    async def _fetch(self, key, func, *args, **kwargs):
+        value = await func(*args, **kwargs)
+        entry = CacheEntry(value)
+        self._store(key, entry)
+        if self.backend is not None:
+            asyncio.ensure_future(self._save(key, entry))
+        return value
+
+    def _store(self, key, entry):
+        try:
+            self.entries[key] = entry
+        except ValueError:
+            # larger than the whole quota of the namespace
+            self.entries.pop(key, None)
+
+    async def _load(self, key):
+        """Moves an entry of the second level cache into memory"""
+        try:
+            data = await self.backend.get(str(key))
+            if data is None:
+                return None
+            created, payload = backends.loads(data)
+            entry = CacheEntry(self.load(key.method, payload, created), created)
+        except Exception:
+            datadog.statsd.increment('statsy.cache.backend_errors', 1, [f'game:{self.game}', 'op:get'])
+            return None
+
+        self._store(key, entry)
+        return entry
+
+    async def _save(self, key, entry):
+        _, hard = self.policies.get(key.method, self.default)
+        try:
+            data = backends.dumps(entry.created, self.dump(key.method, entry.value))
+            await self.backend.set(str(key), data, hard)
+        except Exception:
+            datadog.statsd.increment('statsy.cache.backend_errors', 1, [f'game:{self.game}', 'op:set'])
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import json
+import random
+import time
+
+import datadog
+
+from ext.cache import normalize_tag
+
+
+def clan_tag(tag):
+    """Normalizes a tag of a clan stats board so boards share fetches"""
+    return normalize_tag(tag) or tag.strip('#').upper()
+
+
+async def fetch_clans(game, tags, fetch, bucket, *, concurrency=5, cost=1):
+    """Calls ``fetch`` once per unique tag in ``tags``
+
+    At most ``concurrency`` calls run at once and each one takes
+    ``cost`` tokens from ``bucket``. Returns ``{tag: result}`` where
+    the result of a failed fetch is its exception.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(tag):
+        async with semaphore:
+            await bucket.acquire(cost)
+            try:
+                return tag, await fetch(tag)
+            except Exception as e:
+                return tag, e
+
+    unique = {clan_tag(t) for t in tags}
+    started = time.time()
+    results = dict(await asyncio.gather(*(worker(t) for t in unique)))
+
+    failed = sum(isinstance(i, Exception) for i in results.values())
+    datadog.statsd.increment('statsy.clanstats.fetched', len(results) - failed, [f'game:{game}'])
+    datadog.statsd.increment('statsy.clanstats.failed', failed, [f'game:{game}'])
+    datadog.statsd.histogram('statsy.clanstats.duration', time.time() - started, [f'game:{game}'])
+    return results
+
+
+def board_results(tags, results):
+    """Returns the successful results of a board's tags, in order"""
+    return [r for r in (results.get(clan_tag(t)) for t in tags) if r is not None and not isinstance(r, Exception)]
+
+
+def embed_hash(embed):
+    """Hashes the content of an embed, ignoring its timestamp"""
+    data = embed.to_dict()
+    data.pop('timestamp', None)
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+class BoardScheduler:
+    """Decides when each clan stats board is refreshed
+
+    Every board gets its own schedule, first spread over the whole
+    ``interval`` and then jittered, so edits do not all land at once.
+    The hash of the last embed of each board lets unchanged boards
+    skip their edit, and manual refreshes are debounced.
+    """
+
+    def __init__(self, interval=600, *, jitter=0.1, tick=30, debounce=30, delay=2):
+        self.interval = interval
+        self.jitter = jitter
+        self.tick = tick
+        self.debounce = debounce
+        self.delay = delay
+        self.boards = {}
+        self.hashes = {}
+        self.manual = {}
+
+    def due(self, guilds):
+        """Returns the guild configs in ``guilds`` whose board should be refreshed now"""
+        now = time.time()
+        ids = {g['guild_id'] for g in guilds}
+        for guild_id in self.boards.keys() - ids:
+            self.forget(guild_id)
+
+        due = []
+        for g in guilds:
+            guild_id = g['guild_id']
+            if guild_id not in self.boards:
+                self.boards[guild_id] = now + random.uniform(0, self.interval)
+            elif self.boards[guild_id] <= now:
+                self.boards[guild_id] = now + self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+                due.append(g)
+        return due
+
+    def changed(self, guild_id, embed):
+        """Returns the hash of ``embed`` if it differs from the board's last one"""
+        digest = embed_hash(embed)
+        if self.hashes.get(guild_id) != digest:
+            return digest
+
+    def edited(self, guild_id, digest):
+        self.hashes[guild_id] = digest
+
+    def forget(self, guild_id):
+        """Drops the schedule, hash and manual refresh state of a board"""
+        self.boards.pop(guild_id, None)
+        self.hashes.pop(guild_id, None)
+        if not isinstance(self.manual.get(guild_id), asyncio.Future):
+            self.manual.pop(guild_id, None)
+
+    def request(self, guild_id, func, *args):
+        """Runs a manual refresh, coalescing the ones of the same board"""
+        last = self.manual.get(guild_id)
+        if isinstance(last, asyncio.Future) or (last and time.time() - last < self.debounce):
+            datadog.statsd.increment('statsy.clanstats.debounced', 1)
+            return
+        self.manual[guild_id] = asyncio.ensure_future(self._manual(guild_id, func, *args))
+
+    async def _manual(self, guild_id, func, *args):
+        try:
+            # lets a burst of reactions end before refreshing once
+            await asyncio.sleep(self.delay)
+            await func(*args)
+        finally:
+            self.manual[guild_id] = time.time()
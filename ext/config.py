@@ -0,0 +1,85 @@
+import logging
+
+from cachetools import LRUCache
+from pymongo import ReturnDocument
+
+logger = logging.getLogger('statsy.main')
+
+
+class GuildConfigCache:
+    """In-memory copy of the ``config.guilds`` collection
+
+    Each guild document is loaded once and kept coherent by
+    routing every write through this class. Mongo is only hit
+    on a miss or after an explicit invalidation. Every function
+    in ``watchers`` is called with the id and document of each
+    guild loaded or written, to maintain indexes of the configs. A
+    failing watcher is logged and never fails the read or write.
+    """
+
+    def __init__(self, collection, maxsize=100000):
+        self.collection = collection
+        self.cache = LRUCache(maxsize)
+        self.prefixes = {}
+        self.prefixes_loaded = False
+        self.watchers = []
+
+    async def load_prefixes(self):
+        """Builds the index of every custom prefix"""
+        prefixes = {}
+        async for g in self.collection.find({'prefix': {'$exists': True}}, {'guild_id': 1, 'prefix': 1}):
+            prefixes[g['guild_id']] = g['prefix']
+        self.prefixes = prefixes
+        self.prefixes_loaded = True
+
+    def get_prefix(self, guild_id, default='!'):
+        """Returns the prefix of a guild from the index without any I/O"""
+        return self.prefixes.get(str(guild_id), default)
+
+    def _store(self, key, data):
+        self.cache[key] = data
+        if 'prefix' in data:
+            self.prefixes[key] = data['prefix']
+        else:
+            self.prefixes.pop(key, None)
+        for watcher in self.watchers:
+            try:
+                watcher(key, data)
+            except Exception:
+                logger.exception(f'Guild config watcher {watcher!r} failed on {key}')
+
+    async def get(self, guild_id):
+        """Returns the config of a guild, ``{}`` if there is none"""
+        key = str(guild_id)
+        try:
+            return self.cache[key]
+        except KeyError:
+            data = await self.collection.find_one({'guild_id': key}) or {}
+            self._store(key, data)
+            return data
+
+    async def update(self, guild_id, update, *, upsert=True):
+        """Applies a mongo update document to a guild and caches the result"""
+        key = str(guild_id)
+        data = await self.collection.find_one_and_update(
+            {'guild_id': key}, update, upsert=upsert, return_document=ReturnDocument.AFTER
+        )
+        self._store(key, data or {})
+        return data
+
+    async def delete(self, guild_id):
+        """Deletes the config of a guild"""
+        key = str(guild_id)
+        data = await self.collection.find_one_and_delete({'guild_id': key})
+        self._store(key, {})
+        return data
+
+    def invalidate(self, guild_id=None):
+        """Drops a guild from the cache, or every guild if none is given"""
+        if guild_id is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(str(guild_id), None)
+
+    def __len__(self):
+        return len(self.cache)
@@ -1,4 +1,5 @@
 import io
+import time
 from urllib.parse import urlparse
 
 import discord
@@ -6,12 +7,17 @@ import pymongo
 from colorthief import ColorThief
 from discord.ext import commands
 
+from ext.cache import stale_since
+from locales.i18n import Translator
+
+_ = Translator('Context', __file__)
+
 
 class CustomContext(commands.Context):
     """Custom Context class to provide utility."""
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.session = self.bot.session
+        self.session = self.bot.sessions.get('assets')
         self.force_cog = None
 
     @property
@@ -23,6 +29,18 @@ class CustomContext(commands.Context):
         if self.command:
             return self.command.instance
 
+    async def send(self, content=None, **kwargs):
+        """Notes in the embed footer when it was built from stale cached data"""
+        embed = kwargs.get('embed')
+        created = stale_since.get()
+        if embed is not None and created is not None:
+            minutes = int((time.time() - created) // 60)
+            note = _('Cached {} min ago').format(minutes)
+            if embed.footer.text:
+                note = f'{embed.footer.text} | {note}'
+            embed.set_footer(text=note, icon_url=embed.footer.icon_url)
+        return await super().send(content, **kwargs)
+
     def delete(self):
         """shortcut"""
         return self.message.delete()
@@ -117,7 +135,7 @@ class NoContext(CustomContext):
     def __init__(self, bot, user, **kwargs):
         self.bot = bot
         self.author = user
-        self.session = self.bot.session
+        self.session = self.bot.sessions.get('assets')
         self.prefix = None
         self.guild = getattr(user, 'guild', None)
         self.channel = kwargs.pop('channel', None)
@@ -1,7 +1,10 @@
 import copy
+import io
 
 import discord
 
+from ext import scoring
+from ext.render import assets, encode
 from ext.utils import e, random_color
 from locales.i18n import Translator
 
@@ -9,13 +12,8 @@ _ = Translator('COC Embeds', __file__)
 
 
 async def format_least_valuable(ctx, c):
-    for m in c['memberList']:
-        try:
-            m['score'] = ((m['donations'] / 5) + (m['versusTrophies'] / 7) + (m['trophies'] / 7)) / 3
-        except KeyError:
-            m['score'] = ((m['donations'] / 5) + 0 + (m['trophies'] / 7)) / 3
-
-    to_kick = sorted(c['memberList'], key=lambda m: m['score'])[:4]
+    members = c['memberList']
+    to_kick = scoring.lowest(members, scoring.coc_scores(members))
 
     em = discord.Embed(color=random_color(), description=_('Here are the least valuable members of the clan currently.'))
     em.set_author(name=f"{c['name']} ({c['tag']})")
@@ -40,13 +38,8 @@ async def format_least_valuable(ctx, c):
 
 
 async def format_most_valuable(ctx, c):
-    for m in c['memberList']:
-        try:
-            m['score'] = ((m['donations'] / 5) + (m['versusTrophies'] / 7) + (m['trophies'] / 7)) / 3
-        except KeyError:
-            m['score'] = ((m['donations'] / 5) + 0 + (m['trophies'] / 7)) / 3
-
-    best = sorted(c['memberList'], key=lambda m: m['score'], reverse=True)[:4]
+    members = c['memberList']
+    best = scoring.highest(members, scoring.coc_scores(members))
 
     em = discord.Embed(color=random_color(), description=_('Here are the most valuable members of the clan currently.'))
     em.set_author(name=f"{c['name']} ({c['tag']})")
@@ -335,3 +328,26 @@ async def format_clan(ctx, c):
         embed2.add_field(name=f, value=v)
 
     return [embed, embed2]
+
+
+def war_image(clan_img, opp_img, fmt):
+    """Pastes the badges of both clans on the war background, returns the encoded bytes
+
+    Runs in the render pool so the badges are passed as bytes. They are
+    decoded for this render only, badges are too many to keep.
+    """
+    assets.load_files()
+    clan_img = assets.decode(io.BytesIO(clan_img))
+    opp_img = assets.decode(io.BytesIO(opp_img))
+
+    image = assets.get('war-bg').copy()
+
+    c_box = (60, 55, 572, 567)
+    image.paste(clan_img, c_box, clan_img)
+
+    o_box = (928, 55, 1440, 567)
+    image.paste(opp_img, o_box, opp_img)
+
+    clan_img.close()
+    opp_img.close()
+    return encode(image, fmt)
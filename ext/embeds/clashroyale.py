@@ -2,21 +2,24 @@ import copy
 import datetime
 import math
 import asyncio
+import os
 
 import discord
 
-from ext.utils import e, random_color, asyncexecutor, camel_case
+from ext import scoring
+from ext.render import DECK_SCALE, RenderCache, assets, encode
+from ext.utils import e, random_color, camel_case
 from locales.i18n import Translator
 
 import io
-from PIL import Image
 from PIL import ImageDraw
-from PIL import ImageFont
 
 _ = Translator('CR Embeds', __file__)
 
 images = 'https://royaleapi.github.io/cr-api-assets/cards-png8'
 
+deck_images = RenderCache('deck', directory=os.getenv('render_cache'))
+
 
 def get_card_level(card):
 
@@ -52,213 +55,172 @@ def timestamp(datatime: int):
     ) + ' minutes ago'
 
 
-async def get_image(ctx, url):
-    async with ctx.session.get(url) as resp:
-        file = io.BytesIO(await resp.read())
-    return file
+async def get_card_images(ctx, deck):
+    """Returns ``(name, bytes)`` of the art of the cards in ``deck`` from the asset store"""
+    names = [f'card:{card.key}' for card in deck]
+    tasks = [assets.fetch(ctx.session, name, f'{images}/{card.key}.png') for name, card in zip(names, deck)]
+    return list(zip(names, await asyncio.gather(*tasks)))
 
 
 async def format_random_deck_image_and_send(ctx, deck):
-    tasks = [get_image(ctx, f'{images}/{card.key}.png') for card in deck]
-    tasks.append(get_image(ctx, e('elixirdrop').url))
+    pool = ctx.bot.render_pool
+    key = deck_images.key('random', tuple(card.key for card in deck), pool.format)
+    data = await deck_images.get(key)
+    if data is None:
+        card_images = await get_card_images(ctx, deck)
+        elixirdrop = await assets.fetch(ctx.session, 'elixirdrop', e('elixirdrop').url)
+        cards = [(name, image, card.elixir, None) for (name, image), card in zip(card_images, deck)]
 
-    card_images = await asyncio.gather(*tasks)
-    deck_image = await get_deck_image(card_images, deck=deck)
+        data = await pool.run('deck', get_deck_image, cards, elixirdrop, None, None)
+        await deck_images.set(key, data)
 
     # av = ctx.cog.cr.get_clan_image(p)
     em = discord.Embed(color=random_color())
     if ctx.bot.psa_message:
         em.description = f'*{ctx.bot.psa_message}*'
     # em.set_author(name=f'{p.name} ({p.tag})', icon_url=av)
-    em.set_image(url='attachment://deck.png')
-
-    await ctx.send(file=discord.File(deck_image, 'deck.png'), embed=em)
+    em.set_image(url=f"attachment://{pool.filename('deck')}")
 
-    deck_image.close()
+    await ctx.send(file=discord.File(io.BytesIO(data), pool.filename('deck')), embed=em)
 
 
 async def format_deck_image_and_send(ctx, p):
-    p._current_deck = [p.client.get_card_info(c.name) for c in p.current_deck]
-    tasks = [get_image(ctx, card.icon_urls.medium) for card in p.current_deck]  # f'{images}/{card.key}.png'
-    tasks.append(get_image(ctx, e('elixirdrop').url))
-    tasks.append(get_image(ctx, e('experience').url))
-
-    card_images = await asyncio.gather(*tasks)
-    deck_image = await get_deck_image(card_images, profile=p)
+    pool = ctx.bot.render_pool
+    key = deck_images.key(
+        'profile', tuple((card.name, get_card_level(card)) for card in p.current_deck),
+        p.name, p.arena.name, p.trophies, pool.format
+    )
+    data = await deck_images.get(key)
+    if data is None:
+        card_info = [p.client.get_card_info(c.name) for c in p.current_deck]
+        card_images = await get_card_images(ctx, card_info)
+        elixirdrop = await assets.fetch(ctx.session, 'elixirdrop', e('elixirdrop').url)
+        experience = await assets.fetch(ctx.session, 'experience', e('experience').url)
+        cards = [
+            (name, image, info.elixir, get_card_level(card))
+            for (name, image), info, card in zip(card_images, card_info, p.current_deck)
+        ]
+
+        data = await pool.run(
+            'deck', get_deck_image, cards, elixirdrop, experience, (p.name, p.arena.name, p.trophies)
+        )
+        await deck_images.set(key, data)
 
     av = ctx.cog.cr.get_clan_image(p)
     em = discord.Embed(color=random_color())
     if ctx.bot.psa_message:
         em.description = f'*{ctx.bot.psa_message}*'
     em.set_author(name=f'{p.name} ({p.tag})', icon_url=av)
-    em.set_image(url='attachment://deck.png')
-
-    await ctx.send(file=discord.File(deck_image, 'deck.png'), embed=em)
+    em.set_image(url=f"attachment://{pool.filename('deck')}")
 
-    deck_image.close()
+    await ctx.send(file=discord.File(io.BytesIO(data), pool.filename('deck')), embed=em)
 
 
-def resize(scale, image):
-    scaled_size = tuple([x * scale for x in image.size])
-    image.thumbnail(scaled_size)
+def get_deck_image(cards, elixirdrop, experience, profile, fmt):
+    """Construct the deck with Pillow and return the encoded bytes.
 
+    Runs in the render pool so every argument is plain data: ``cards``
+    is a list of ``(name, image bytes, elixir, level)``, ``profile`` is
+    ``(name, arena, trophies)`` and the overlays are image bytes. The
+    layout is in the units of the full size assets and is composed
+    directly at ``DECK_SCALE``.
+    """
+    def px(*values):
+        return tuple(int(v * DECK_SCALE) for v in values)
 
-@asyncexecutor()
-def get_deck_image(card_images, *, profile=None, deck=None):
-    """Construct the deck with Pillow and return image."""
+    assets.load_files()
+    elixirdrop = assets.image('elixirdrop', elixirdrop, scale=DECK_SCALE)
     if profile:
-        card_info = profile._current_deck
-        deck = profile.current_deck
-        experience = Image.open(card_images.pop(-1)).convert("RGBA")
-        resize(0.7, experience)
-    else:
-        card_info = deck
-
-    elixirdrop = Image.open(card_images.pop(-1)).convert("RGBA")
-    statsy = Image.open('data/rounded.png').convert('RGBA')
-    resize(0.1, statsy)
+        experience = assets.image('experience', experience, scale=0.7 * DECK_SCALE)
+    statsy = assets.get('statsy')
 
     card_w = 302
     card_x = 30
     card_y = 30
-    font_size = 50
     txt_y_line1 = 430
     txt_y_line2 = 500
     txt_x_name = 50
     txt_x_cards = 503
     txt_x_elixir = 1872 + 300
 
-    bg_image = Image.open("data/deck-bg.png")
-    size = bg_image.size
-
-    font_file_regular = "data/fonts/OpenSans-Regular.ttf"
-    font_file_bold = "data/fonts/OpenSans-Bold.ttf"
-    font_file_supercell = "data/fonts/Supercell-magic-webfont.ttf"
+    bg_image = assets.get('deck-bg')
 
-    font_regular = ImageFont.truetype(font_file_regular, size=font_size)
-    font_bold = ImageFont.truetype(font_file_bold, size=font_size)
-    font_supercell = ImageFont.truetype(font_file_supercell, size=40)
+    font_regular = assets.fonts['regular']
+    font_bold = assets.fonts['bold']
+    font_supercell = assets.fonts['supercell']
 
     white = (0xff, 0xff, 0xff, 255)
 
-    image = Image.new("RGBA", size)
-    image.paste(bg_image)
-    image.paste(statsy, (txt_x_elixir - 130, txt_y_line1 + 25), statsy)  # -150
+    image = bg_image.copy()
+    image.paste(statsy, px(txt_x_elixir - 130, txt_y_line1 + 25), statsy)  # -150
 
-    total_elixir = sum(c.elixir for c in card_info)
-    average_elixir = "{:.1f}".format(total_elixir / len(deck))
+    total_elixir = sum(card[2] for card in cards)
+    average_elixir = "{:.1f}".format(total_elixir / len(cards))
 
-    txt = Image.new("RGBA", size)
-    txt_name = Image.new("RGBA", size)
-    txt_levels = Image.new("RGBA", size)
-
-    d = ImageDraw.Draw(txt)
-    d_name = ImageDraw.Draw(txt_name)
-    d_levels = ImageDraw.Draw(txt_levels)
-
-    for (i, card_file), card_info, card in zip(enumerate(card_images), card_info, deck):
-        card_image = Image.open(card_file).convert("RGBA")
-        # size = (card_w, card_h)
-        # card_image.thumbnail(size)
+    # cards are pasted before any text is drawn so the text stays on top
+    levels = []
+    for i, (name, card_file, elixir, level) in enumerate(cards):
+        card_image = assets.image(name, card_file, scale=DECK_SCALE)
         card_corner = (card_x + card_w * i, card_y)
         elixir_corner = (card_corner[0] - 17, card_corner[1] - 20)
         experience_corner = (elixir_corner[0] + 10, elixir_corner[1] + 270)
 
-        elixir = str(card_info.elixir)
-        if profile:
-            level = str(get_card_level(card))
-            level_size = d_levels.textsize(level, font=font_supercell)
-
-        x, y = card_corner[0] + 20, card_corner[1] + 15
-        top_text_corner = (x, y)
+        image.paste(card_image, px(*card_corner), card_image)
+        image.paste(elixirdrop, px(*elixir_corner), elixirdrop)
 
         if profile:
-            w = level_size[0]
-            ew = experience.size[0]
-
-            delta_x = experience_corner[0]
+            image.paste(experience, px(*experience_corner), experience)
 
-            x, y = delta_x + abs((w - ew) / 2), y + 250  # center level text
-            bottom_text_corner = (x, y)
+        levels.append((card_corner[0] + 20, card_corner[1] + 15, experience_corner[0], elixir, level))
 
-        d_levels.text(top_text_corner, elixir, font=font_supercell, fill=white)
+    d = ImageDraw.Draw(image, 'RGBA')
 
-        if profile:
-            d_levels.text(bottom_text_corner, level, font=font_supercell, fill=white)
-
-        image.paste(card_image, card_corner, card_image)
-        image.paste(elixirdrop, elixir_corner, elixirdrop)
+    for x, y, experience_x, elixir, level in levels:
+        d.text(px(x, y), str(elixir), font=font_supercell, fill=white)
 
         if profile:
-            image.paste(experience, experience_corner, experience)
+            level = str(level)
+            w = d.textsize(level, font=font_supercell)[0]
+            ew = experience.size[0]
 
-        card_image.close()
+            x = experience_x * DECK_SCALE + abs((w - ew) / 2)  # center level text
+            d.text((int(x), int((y + 250) * DECK_SCALE)), level, font=font_supercell, fill=white)
 
-    d_name.text(
-        (txt_x_name, txt_y_line1), 'Deck', font=font_bold,
+    d.text(
+        px(txt_x_name, txt_y_line1), 'Deck', font=font_bold,
         fill=white)
 
     d.text(
-        (txt_x_elixir, txt_y_line1), "Avg elixir", font=font_bold,
+        px(txt_x_elixir, txt_y_line1), "Avg elixir", font=font_bold,
         fill=(0xff, 0xff, 0xff, 200))
 
     d.text(
-        (txt_x_elixir, txt_y_line2), average_elixir, font=font_bold,
+        px(txt_x_elixir, txt_y_line2), average_elixir, font=font_bold,
         fill=white)
 
     if profile:
-        d_name.text(
-            (txt_x_name, txt_y_line2), profile.name, font=font_regular,
+        name, arena, trophies = profile
+        d.text(
+            px(txt_x_name, txt_y_line2), name, font=font_regular,
             fill=white)
         d.text(
-            (txt_x_cards, txt_y_line1), profile.arena.name, font=font_bold,
+            px(txt_x_cards, txt_y_line1), arena, font=font_bold,
             fill=white)
         d.text(
-            (txt_x_cards, txt_y_line2), f'{profile.trophies} Trophies', font=font_regular,
+            px(txt_x_cards, txt_y_line2), f'{trophies} Trophies', font=font_regular,
             fill=white)
-        experience.close()
     else:
-        d_name.multiline_text(
-            (txt_x_name, txt_y_line2), 'Randomly Generated', font=font_regular,
+        d.multiline_text(
+            px(txt_x_name, txt_y_line2), 'Randomly Generated', font=font_regular,
             fill=white)
 
-    image.paste(txt_name, (0, 0), txt_name)
-
-    image.paste(txt, (0, 0), txt)
-
-    image.paste(txt_levels, (0, 0), txt_levels)
-
-    # scale down and return
-    resize(0.5, image)
-
-    file = io.BytesIO()
-
-    image.save(file, format='PNG')
-
-    statsy.close()
-    elixirdrop.close()
-    bg_image.close()
-    image.close()
-
-    file.seek(0)
-
-    return file
+    return encode(image, fmt)
 
 
 async def format_least_valuable(ctx, clan, wars):
-    async def war_score(tag):
-        score = 0
-        async for w in wars:
-            if tag in [i.tag for i in w.participants]:
-                score += 1
-
-        return score
-
-    for m in clan.member_list:
-        m.war_score = await war_score(m.tag)
-        m.score = ((m.donations / 5) + (m.war_score / 3) + (m.trophies / 7)) / 3
-
-    to_kick = sorted(clan.member_list, key=lambda m: m.score)[:4]
+    war_counts = scoring.war_participation(wars)
+    members = list(clan.member_list)
+    to_kick = scoring.lowest(members, scoring.cr_scores(members, war_counts))
 
     em = discord.Embed(
         color=random_color(),
@@ -276,25 +238,15 @@ async def format_least_valuable(ctx, clan, wars):
             value=f"{m.tag}\n{m.trophies} "
                   f"{e('crownblue')}\n{m.donations} "
                   f"{e('cards')}\n"
-                  f"{m.war_score} {e('clanwar')}"
+                  f"{war_counts[m.tag]} {e('clanwar')}"
         )
     return em
 
 
 async def format_most_valuable(ctx, clan, wars):
-    async def war_score(tag):
-        score = 0
-        async for w in wars:
-            if tag in [i.tag for i in w.participants]:
-                score += 1
-
-        return score
-
-    for m in clan.member_list:
-        m.war_score = await war_score(m.tag)
-        m.score = ((m.donations / 5) + (m.war_score / 3) + (m.trophies / 7)) / 3
-
-    best = sorted(clan.member_list, key=lambda m: m.score, reverse=True)[:4]
+    war_counts = scoring.war_participation(wars)
+    members = list(clan.member_list)
+    best = scoring.highest(members, scoring.cr_scores(members, war_counts))
 
     em = discord.Embed(
         color=random_color(),
@@ -312,7 +264,7 @@ async def format_most_valuable(ctx, clan, wars):
             value=f"{m.tag}\n{m.trophies} "
             f"{e('crownblue')}\n{m.donations} "
             f"{e('cards')}\n"
-            f"{m.war_score} {e('clanwar')}"
+            f"{war_counts[m.tag]} {e('clanwar')}"
         )
 
     return em
@@ -484,14 +436,7 @@ async def format_members(ctx, c, ws):
     em.set_thumbnail(url=ctx.cog.cr.get_clan_image(c))
     embeds = []
     counter = 0
-
-    async def war_score(tag):
-        score = 0
-        async for w in ws:
-            if tag in [i.tag for i in w.participants]:
-                score += 1
-
-        return score
+    war_counts = scoring.war_participation(ws)
 
     for m in c.member_list:
         if counter % 6 == 0 and counter != 0:
@@ -506,89 +451,44 @@ async def format_members(ctx, c, ws):
             value=f"{m.tag}\n{m.trophies} "
                   f"{e('crownblue')}\n{m.donations} "
                   f"{e('cards')}\n"
-                  f"{await war_score(m.tag)} {e('clanwar')}"
+                  f"{war_counts[m.tag]} {e('clanwar')}"
         )
         counter += 1
     embeds.append(em)
     return embeds
 
 
-async def format_lb(ctx, players, tag, emoji_name, *statistics, **kwargs):
-    color = random_color()
-    embeds = [discord.Embed(
+def format_lb_line(ctx, n, player, emoji_name, statistic):
+    user = ctx.guild.get_member(player['user_id']) or player['user_id']
+    str_n = f'0{n}' if n < 10 else n
+    return f'`{str_n}.` {e(emoji_name)} `{player[statistic]}`: {player["name"]} ({player["tag"]}) - {user}'
+
+
+def format_lb(ctx, players, start, emoji_name, statistic, nearby, rank, **kwargs):
+    """Formats one page of a leaderboard, ``players`` being ranked from ``start``
+
+    ``nearby`` are the players ranked around the author's own ``rank``.
+    """
+    em = discord.Embed(
         title=_('{} Leaderboard').format(kwargs.get('name', ctx.command.name.title())),
-        description='',
-        color=color
-    )]
-
-    n = 0
-    found_user = [False, 0]
-    users = []
-    previous_page = False
-    for p in players:
-        user = ctx.guild.get_member(int(p.split('-')[0]))
-
-        stat = players[p]
-        for i in statistics:
-            stat = stat[i]
-
-        if user:
-            str_n = f'0{n + 1}' if n + 1 < 10 else n + 1
-            embeds[-1].description += f'`{str_n}.` {e(emoji_name)} `{stat}`: {players[p]["name"]} ({players[p]["tag"]}) - {user}\n'
-            n += 1
-
-            if found_user[0]:
-                cur_line = len(embeds[-1].description.splitlines()) - 1
-                try:
-                    users[found_user[1] + 3] = embeds[-1].description.splitlines()[cur_line]
-                except IndexError:
-                    cur_line = 9
-                    users[found_user[1] + 3] = embeds[len(embeds) - 2].description.splitlines()[cur_line]
-                cur_line -= 1
-
-                found_user[1] += 1
-                if found_user[1] >= 2:
-                    found_user[0] = False
-
-            if p == f'{ctx.author.id}-{tag}':
-                cur_line = len(embeds[-1].description.splitlines()) - 1
-                users = ['', '', f'**{embeds[-1].description.splitlines()[cur_line]}**', '', '']
-                found_user[0] = True
-                cur_line -= 2
-                for i in range(2):
-                    try:
-                        users[i] = embeds[-1].description.splitlines()[cur_line]
-                    except IndexError:
-                        if not previous_page:
-                            cur_line = 8
-                            previous_page = True
-                        try:
-                            users[i] = embeds[-2].description.splitlines()[cur_line]
-                        except IndexError:
-                            break
-                    cur_line += 1
-
-            if (n % 10) == 0:
-                embeds.append(discord.Embed(
-                    title=_('{} Leaderboard').format(kwargs.get('name', ctx.command.name.title())),
-                    description='',
-                    color=color
-                ))
+        description='\n'.join(
+            format_lb_line(ctx, start + n + 1, p, emoji_name, statistic) for n, p in enumerate(players)
+        ) + '\n',
+        color=kwargs.get('color') or random_color()
+    )
 
-    try:
-        list(players.keys()).index(f'{ctx.author.id}-{tag}')
-    except ValueError:
+    if rank is None:
         value = _("Your data has not been recieved yet. Either your tag isn't saved or you have to wait a while")
     else:
+        first = max(rank - 2, 0)
+        users = ['', '', '', '', '']
+        for n, p in enumerate(nearby, start=first):
+            line = format_lb_line(ctx, n + 1, p, emoji_name, statistic)
+            users[n - rank + 2] = f'**{line}**' if n == rank else line
         value = '\n'.join(users)
 
-    for x in embeds:
-        if x.description:
-            x.add_field(name=_('Your position'), value=value)
-        else:
-            embeds.remove(x)
-
-    return embeds
+    em.add_field(name=_('Your position'), value=value)
+    return em
 
 
 async def format_top_players(ctx, players, region):
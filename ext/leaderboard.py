@@ -0,0 +1,209 @@
+import asyncio
+import time
+
+import datadog
+
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReplaceOne
+
+# leaderboard statistics and their path in a player of the CR API
+STATISTICS = {
+    'trophies': ('trophies',),
+    'expLevel': ('expLevel',),
+    'totalDonations': ('totalDonations',),
+    'clanCardsCollected': ('clanCardsCollected',),
+    'challengeCardsWon': ('challengeCardsWon',),
+    'challengeMaxWins': ('challengeMaxWins',),
+    'clansJoined': ('achievements', 0, 'value')
+}
+
+
+def get_statistic(data, statistic):
+    """Follows the ``statistic`` path in a player, None if it is missing"""
+    try:
+        for i in statistic:
+            data = data[i]
+    except (KeyError, IndexError, TypeError):
+        return None
+    return data
+
+
+class LeaderboardStore:
+    """Players of the CR leaderboard in a mongo collection
+
+    Each player is keyed by ``'{user_id}-{tag}'`` with every statistic
+    of ``STATISTICS`` as a top level field. Every statistic has an index
+    on ``(user_id, statistic, _id)`` so a page of a guild's leaderboard
+    is one indexed sort and limit.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def create_indexes(self):
+        await self.collection.create_indexes([
+            IndexModel([('user_id', ASCENDING), (i, DESCENDING), ('_id', ASCENDING)])
+            for i in STATISTICS
+        ])
+
+    @staticmethod
+    def document(key, player):
+        """Converts a player of the API into a leaderboard document"""
+        doc = {
+            '_id': key,
+            'user_id': int(key.split('-')[0]),
+            'tag': player.get('tag'),
+            'name': player.get('name'),
+            'timestamp': player.get('timestamp') or time.time()
+        }
+        for name, path in STATISTICS.items():
+            doc[name] = get_statistic(player, path)
+        return doc
+
+    async def update(self, key, player):
+        """Adds or replaces a player"""
+        await self.collection.replace_one({'_id': key}, self.document(key, player), upsert=True)
+
+    async def import_players(self, players, *, batch_size=1000):
+        """Upserts a ``{key: player}`` dict in batches, returns the number of players"""
+        batch = []
+        for key, player in players.items():
+            doc = self.document(key, player)
+            batch.append(ReplaceOne({'_id': key}, doc, upsert=True))
+            if len(batch) >= batch_size:
+                await self.collection.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            await self.collection.bulk_write(batch, ordered=False)
+        return len(players)
+
+    async def fresh(self, keys, since):
+        """Returns the keys among ``keys`` updated after the ``since`` timestamp"""
+        cursor = self.collection.find({'_id': {'$in': list(keys)}, 'timestamp': {'$gte': since}}, {'_id': 1})
+        return {i['_id'] async for i in cursor}
+
+    @staticmethod
+    def query(statistic, user_ids):
+        return {'user_id': {'$in': list(user_ids)}, statistic: {'$ne': None}}
+
+    async def count(self, statistic, user_ids):
+        """Returns the number of ranked players among ``user_ids``"""
+        return await self.collection.count_documents(self.query(statistic, user_ids))
+
+    async def page(self, statistic, user_ids, skip, limit):
+        """Returns ``limit`` players after the first ``skip`` among ``user_ids``"""
+        cursor = self.collection.find(self.query(statistic, user_ids)).sort(
+            [(statistic, DESCENDING), ('_id', ASCENDING)]
+        ).skip(skip).limit(limit)
+        return await cursor.to_list(limit)
+
+    async def rank(self, statistic, user_ids, key):
+        """Returns the 0-based rank of ``key`` among ``user_ids``, None if it is not ranked"""
+        player = await self.collection.find_one({'_id': key})
+        if player is None or player.get(statistic) is None or player['user_id'] not in user_ids:
+            return None
+
+        query = self.query(statistic, user_ids)
+        query['$or'] = [
+            {statistic: {'$gt': player[statistic]}},
+            {statistic: player[statistic], '_id': {'$lt': key}}
+        ]
+        return await self.collection.count_documents(query)
+
+
+class LeaderboardImporter:
+    """Keeps the leaderboard current for every saved tag
+
+    Each run walks the saved tags of ``tags`` (the player_tags
+    collection) in batches of ``batch_size`` and refreshes the players
+    not updated in the last ``max_age`` seconds by a tag save or magic
+    caching. ``fetch(tag)`` returns a player of the API. Requests take
+    a token from ``bucket``, so a run is spread over time instead of
+    competing with commands for the API.
+    """
+
+    def __init__(self, store, tags, fetch, bucket, *, max_age=86400, batch_size=100):
+        self.store = store
+        self.tags = tags
+        self.fetch = fetch
+        self.bucket = bucket
+        self.max_age = max_age
+        self.batch_size = batch_size
+
+    async def refresh(self, key, tag):
+        await self.bucket.acquire()
+        try:
+            player = await self.fetch(tag)
+        except Exception:
+            datadog.statsd.increment('statsy.leaderboard.import_failed', 1)
+            return
+        await self.store.update(key, player.raw_data)
+        datadog.statsd.increment('statsy.leaderboard.imported', 1)
+
+    async def refresh_batch(self, batch):
+        fresh = await self.store.fresh(batch, time.time() - self.max_age)
+        await asyncio.gather(*(self.refresh(k, t) for k, t in batch.items() if k not in fresh))
+
+    async def run(self):
+        """Refreshes every outdated saved player once"""
+        batch = {}
+        async for doc in self.tags.find({}, {'user_id': 1, 'tag': 1}):
+            for tag in (doc.get('tag') or {}).values():
+                if tag:
+                    batch[f"{doc['user_id']}-{tag}"] = tag
+            if len(batch) >= self.batch_size:
+                await self.refresh_batch(batch)
+                batch = {}
+        if batch:
+            await self.refresh_batch(batch)
+
+
+class GuildMembers:
+    """Members of each guild that have a saved tag
+
+    A guild is indexed the first time it is requested, after which
+    member joins, leaves and tag saves keep it up to date.
+    """
+
+    def __init__(self):
+        self.saved = None
+        self.guilds = {}
+
+    async def load(self, collection):
+        """Loads every user with a saved tag from ``collection``"""
+        self.saved = {int(i) for i in await collection.distinct('user_id')}
+        self.guilds.clear()
+
+    def get(self, guild):
+        """Returns the ids of the members of ``guild`` with a saved tag"""
+        if self.saved is None:
+            return [m.id for m in guild.members]
+
+        try:
+            return self.guilds[guild.id]
+        except KeyError:
+            if len(self.saved) < guild.member_count:
+                members = {i for i in self.saved if guild.get_member(i)}
+            else:
+                members = {m.id for m in guild.members if m.id in self.saved}
+            self.guilds[guild.id] = members
+            return members
+
+    def save(self, user_id, bot):
+        """Records a tag save by ``user_id``"""
+        if self.saved is None:
+            return
+        self.saved.add(user_id)
+        for guild_id, members in self.guilds.items():
+            guild = bot.get_guild(guild_id)
+            if guild and guild.get_member(user_id):
+                members.add(user_id)
+
+    def member_join(self, member):
+        if self.saved is not None and member.id in self.saved and member.guild.id in self.guilds:
+            self.guilds[member.guild.id].add(member.id)
+
+    def member_remove(self, member):
+        self.guilds.get(member.guild.id, set()).discard(member.id)
+
+    def remove_guild(self, guild_id):
+        self.guilds.pop(guild_id, None)
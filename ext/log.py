@@ -1,15 +1,101 @@
+import asyncio
 import logging
-import requests
 import os
+from collections import deque
+
+import datadog
 
 
 class LoggingHandler(logging.Handler):
-    def __init__(self, log_level):
+    """Sends records to the log webhook without blocking the event loop
+
+    ``emit`` only queues the formatted record. A background task
+    posts the queue in batches of one webhook message, waiting out
+    the webhook rate limit when it is hit. Records are dropped
+    and counted when the queue is full.
+    """
+
+    def __init__(self, log_level, session, *, loop=None, maxsize=1000, interval=2):
         super().__init__(log_level)
         super().setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
+        self.session = session
+        self.url = os.getenv('log_hook')
+        self.maxsize = maxsize
+        self.interval = interval
+        self.records = deque()
+        self.dropped = 0
+        self.task = (loop or asyncio.get_event_loop()).create_task(self.worker())
 
     def emit(self, record):
-        print(record)
-        log_entry = self.format(record)
-        print(log_entry)
-        return requests.post(os.getenv('log_hook'), log_entry).content
+        if len(self.records) >= self.maxsize:
+            self.dropped += 1
+            datadog.statsd.increment('statsy.logs.dropped', 1)
+            return
+
+        try:
+            self.records.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def next_batch(self, limit=1990):
+        """Pops as many records as fit in one message"""
+        lines = []
+        size = 0
+        if self.dropped:
+            lines.append(f'{self.dropped} log records dropped')
+            size += len(lines[0]) + 1
+            self.dropped = 0
+
+        while self.records:
+            line = self.records[0][:limit]
+            if lines and size + len(line) + 1 > limit:
+                break
+            self.records.popleft()
+            lines.append(line)
+            size += len(line) + 1
+        return lines
+
+    async def post(self, lines):
+        """Posts a batch, returns the seconds to wait before the next one"""
+        async with self.session.post(self.url, json={'content': '\n'.join(lines)}) as resp:
+            if resp.status == 429:
+                # put the batch back in order
+                self.records.extendleft(reversed(lines))
+                data = await resp.json()
+                return data.get('retry_after', 1000) / 1000
+            if resp.headers.get('X-RateLimit-Remaining') == '0':
+                return float(resp.headers.get('X-RateLimit-Reset-After', self.interval))
+        return 0
+
+    async def worker(self):
+        while True:
+            delay = self.interval
+            if self.records or self.dropped:
+                try:
+                    delay = max(await self.post(self.next_batch()), self.interval)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    datadog.statsd.increment('statsy.logs.failed', 1)
+            await asyncio.sleep(delay)
+
+    async def shutdown(self, timeout=30):
+        """Stops the worker and posts the records still queued, for up to ``timeout`` seconds"""
+        self.task.cancel()
+        try:
+            await asyncio.wait_for(self.post_remaining(), timeout)
+        except asyncio.TimeoutError:
+            datadog.statsd.increment('statsy.logs.dropped', len(self.records))
+
+    async def post_remaining(self):
+        while self.records or self.dropped:
+            try:
+                await asyncio.sleep(await self.post(self.next_batch()))
+            except Exception:
+                datadog.statsd.increment('statsy.logs.failed', 1)
+                return
+
+    def close(self):
+        # records still queued are lost unless shutdown was awaited first
+        self.task.cancel()
+        super().close()
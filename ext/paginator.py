@@ -41,14 +41,11 @@ class Paginator:
         if len(self.embeds) == 0:
             raise SyntaxError('There should be at least 1 embed object provided to the paginator')
 
-        if kwargs.get('edit_footer', True) and len(self.embeds) > 1:
-            for i, em in enumerate(self.embeds):
-                footer_text = f'Page {i+1} of {len(self.embeds)}'
-                em.footer.text = kwargs.get('footer_text', em.footer.text)
-                if em.footer.text:
-                    footer_text = footer_text + ' | ' + em.footer.text
-
-                em.set_footer(text=footer_text, icon_url=em.footer.icon_url)
+        self.edit_footer = kwargs.get('edit_footer', True)
+        self.footer_text = kwargs.get('footer_text')
+        for i, em in enumerate(self.embeds):
+            if em is not None:
+                self.set_page_footer(i, em)
 
         self.page = 0
         self.ctx = ctx
@@ -63,6 +60,16 @@ class Paginator:
         }
         self.destination = kwargs.get('dest', ctx)
 
+    def set_page_footer(self, i, em):
+        """Adds the page number to the footer of an embed"""
+        if self.edit_footer and len(self.embeds) > 1:
+            footer_text = f'Page {i+1} of {len(self.embeds)}'
+            em.footer.text = self.footer_text or em.footer.text
+            if em.footer.text:
+                footer_text = footer_text + ' | ' + em.footer.text
+
+            em.set_footer(text=footer_text, icon_url=em.footer.icon_url)
+
     async def start(self):
         """Starts the paginator session"""
         self.message = await self.destination.send(embed=self.embeds[0])
@@ -160,7 +167,37 @@ class WikiPaginator(Paginator):
         super().__init__(ctx, *embeds, **kwargs)
         self.brawler_power = brawler_power
         if self.brawler_power:
-            self.emojis[str(e('28000000', ctx=self.ctx))] = 'jump_to_player'
+            self.emojis[str(e('28000000'))] = 'jump_to_player'
 
     async def exec_jump_to_player(self):
         self.page = self.brawler_power
+
+
+class LazyPaginator(Paginator):
+    """Paginator that only builds a page when it is first shown
+
+    Parameters
+    ------------
+    ctx: discord.Context
+        The context of the command.
+    pages: int
+        The number of pages.
+    get_page: Callable[[int], Awaitable[discord.Embed]]
+        Builds the embed of a page from its index.
+    """
+    def __init__(self, ctx, pages, get_page, **kwargs):
+        self.get_page = get_page
+        super().__init__(ctx, *[None] * pages, **kwargs)
+
+    async def load_page(self):
+        if self.embeds[self.page] is None:
+            em = await self.get_page(self.page)
+            self.set_page_footer(self.page, em)
+            self.embeds[self.page] = em
+
+    async def start(self):
+        await self.load_page()
+        await super().start()
+
+    async def exec_before_edit(self):
+        await self.load_page()
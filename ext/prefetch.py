@@ -0,0 +1,82 @@
+import time
+
+import datadog
+from cachetools import LRUCache
+
+from ext.ratelimit import TokenBucket
+
+
+class TypingStats:
+    """How often the typing of a user was followed by a command"""
+    __slots__ = ('typed', 'checks', 'hits', 'hit')
+
+    def __init__(self):
+        self.typed = 0
+        self.checks = 0
+        self.hits = 0
+        self.hit = False
+
+    @property
+    def hit_rate(self):
+        # starts at 0.5 and converges to the observed rate
+        return (self.hits + 1) / (self.checks + 2)
+
+
+class Prefetcher:
+    """Decides which typing users get their data prefetched (magic caching)
+
+    A user is checked at most once per ``cooldown`` seconds and scored
+    by how often a check was followed by a command of the game within
+    ``window`` seconds. Users whose hit rate is below ``min_hit_rate``
+    are not prefetched. Prefetches share a budget of ``rate`` upstream
+    requests per second, bursting up to ``capacity``, and each one
+    costs ``cost`` requests.
+    """
+
+    def __init__(self, game, *, cost, rate=5, capacity=50, cooldown=120, window=120,
+                 min_hit_rate=0.1, decay=50, maxsize=100000):
+        self.game = game
+        self.cost = cost
+        self.bucket = TokenBucket(rate=rate, capacity=capacity)
+        self.cooldown = cooldown
+        self.window = window
+        self.min_hit_rate = min_hit_rate
+        self.decay = decay
+        self.users = LRUCache(maxsize)
+
+    def skip(self, reason):
+        datadog.statsd.increment('statsy.magic_caching.skipped', 1, [f'reason:{reason}', f'game:{self.game}'])
+        return False
+
+    def check(self, user_id):
+        """Records a typing event, returns whether the user is worth prefetching"""
+        now = time.time()
+        stats = self.users.get(user_id)
+        if stats is None:
+            stats = self.users[user_id] = TypingStats()
+        elif now - stats.typed < self.cooldown:
+            return False
+
+        stats.typed = now
+        stats.checks += 1
+        stats.hit = False
+        if stats.checks > self.decay:
+            # older behaviour weighs less
+            stats.checks //= 2
+            stats.hits //= 2
+
+        if stats.hit_rate < self.min_hit_rate:
+            return self.skip('score')
+        return True
+
+    def spend(self):
+        """Takes the cost of a prefetch from the budget if it is available"""
+        return self.bucket.take(self.cost) or self.skip('budget')
+
+    def used(self, user_id):
+        """Records a command, a hit if the user was checked recently"""
+        stats = self.users.get(user_id)
+        if stats is not None and not stats.hit and time.time() - stats.typed < self.window:
+            stats.hit = True
+            stats.hits += 1
+            datadog.statsd.increment('statsy.magic_caching.hit', 1, [f'game:{self.game}'])
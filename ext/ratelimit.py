@@ -0,0 +1,26 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Allows ``rate`` tokens per second with bursts of up to ``capacity``"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, tokens=1):
+        """Takes ``tokens`` if they are available, without waiting"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens=1):
+        while not self.take(tokens):
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
@@ -0,0 +1,279 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import datadog
+from cachetools import LRUCache
+from PIL import Image, ImageFont
+
+
+class RenderCache:
+    """Rendered images addressed by the content they were made from
+
+    Images are kept in an LRU bounded by their size in bytes and, when
+    ``directory`` is set, written there so they survive restarts. Reads
+    touch the files, and every ``prune_every`` writes the least recently
+    used ones are deleted until the images of this cache take at most
+    ``disk_size`` bytes.
+    """
+
+    def __init__(self, name, maxsize=32 * 1024**2, *, directory=None, disk_size=512 * 1024**2, prune_every=100):
+        self.name = name
+        self.memory = LRUCache(maxsize, getsizeof=len)
+        self.directory = directory
+        self.disk_size = disk_size
+        self.prune_every = prune_every
+        self.writes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """Returns the content address of an image rendered from ``parts``"""
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{self.name}-{key}')
+
+    def _read(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            # pruned meanwhile
+            pass
+        return data
+
+    def _write(self, key, data):
+        tmp = self.path(key) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self.path(key))
+
+    def _prune(self):
+        """Deletes the least recently used images until they fit in ``disk_size``"""
+        files = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith(f'{self.name}-') and not entry.name.endswith('.tmp'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.disk_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+
+        datadog.statsd.increment('statsy.render_cache.pruned', removed, [f'image:{self.name}'])
+
+    def _remember(self, key, data):
+        try:
+            self.memory[key] = data
+        except ValueError:
+            # larger than the whole cache
+            pass
+
+    async def get(self, key):
+        """Returns the bytes of a rendered image or None"""
+        data = self.memory.get(key)
+        if data is None and self.directory:
+            data = await asyncio.get_event_loop().run_in_executor(None, self._read, key)
+            if data is not None:
+                self._remember(key, data)
+
+        datadog.statsd.increment('statsy.render_cache', 1, [f'image:{self.name}', f'hit:{data is not None}'])
+        return data
+
+    async def set(self, key, data):
+        self._remember(key, data)
+        if self.directory:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._write, key, data)
+            self.writes += 1
+            if self.writes % self.prune_every == 0:
+                await loop.run_in_executor(None, self._prune)
+
+
+# deck images are composed directly at this fraction of the size of their assets
+DECK_SCALE = 0.5
+
+FORMATS = {'png', 'webp'}
+
+
+def resize(scale, image):
+    scaled_size = tuple([x * scale for x in image.size])
+    image.thumbnail(scaled_size)
+
+
+def encode(image, fmt):
+    """Encodes an RGBA image as an optimized palette PNG or a WebP, returns the bytes"""
+    file = io.BytesIO()
+    if fmt == 'webp':
+        image.save(file, format='WEBP', quality=90, method=4)
+    else:
+        image = image.quantize(256, method=Image.FASTOCTREE)
+        image.save(file, format='PNG', optimize=True)
+    image.close()
+    return file.getvalue()
+
+
+class AssetStore:
+    """Decoded images and fonts shared by the renderers
+
+    Local files are loaded once by ``load_files``. Static remote images
+    such as card art are downloaded once by the bot and kept as bytes,
+    which is what gets sent to the render workers. Each renderer decodes
+    them once with ``image``. Renderers only read from the assets, they
+    must never modify or close them.
+
+    Dynamic images such as clan badges are unbounded in number, so they
+    are fetched with ``dynamic=True``. Their bytes are kept in an LRU of
+    at most ``dynamic_size`` bytes and renderers decode them per job
+    with ``decode`` instead of keeping them.
+    """
+
+    def __init__(self, directory='data', *, dynamic_size=16 * 1024**2):
+        self.directory = directory
+        self.images = {}
+        self.fonts = {}
+        self.files = {}
+        self.dynamic = LRUCache(dynamic_size, getsizeof=len)
+        self.loaded = False
+
+    def load_files(self):
+        if self.loaded:
+            return
+
+        self.images['deck-bg'] = self.decode(os.path.join(self.directory, 'deck-bg.png'), scale=DECK_SCALE)
+        self.images['war-bg'] = self.decode(os.path.join(self.directory, 'war-bg.png'))
+        self.images['statsy'] = self.decode(os.path.join(self.directory, 'rounded.png'), scale=0.1 * DECK_SCALE)
+
+        fonts = os.path.join(self.directory, 'fonts')
+        self.fonts['regular'] = ImageFont.truetype(os.path.join(fonts, 'OpenSans-Regular.ttf'), size=int(50 * DECK_SCALE))
+        self.fonts['bold'] = ImageFont.truetype(os.path.join(fonts, 'OpenSans-Bold.ttf'), size=int(50 * DECK_SCALE))
+        self.fonts['supercell'] = ImageFont.truetype(
+            os.path.join(fonts, 'Supercell-magic-webfont.ttf'), size=int(40 * DECK_SCALE)
+        )
+        self.loaded = True
+
+    @staticmethod
+    def decode(fp, *, scale=None):
+        image = Image.open(fp).convert('RGBA')
+        if scale:
+            resize(scale, image)
+        return image
+
+    def get(self, name):
+        return self.images.get(name)
+
+    def image(self, name, data, *, scale=None):
+        """Returns the decoded image of ``name``, decoding ``data`` the first time"""
+        if name not in self.images:
+            self.images[name] = self.decode(io.BytesIO(data), scale=scale)
+        return self.images[name]
+
+    async def fetch(self, session, name, url, *, dynamic=False):
+        """Returns the bytes of a remote image, downloading it the first time"""
+        files = self.dynamic if dynamic else self.files
+        data = files.get(name)
+        if data is None:
+            async with session.get(url) as resp:
+                resp.raise_for_status()
+                data = await resp.read()
+            try:
+                files[name] = data
+            except ValueError:
+                # larger than the whole cache
+                pass
+        return data
+
+    async def prefetch(self, session, urls, *, concurrency=8):
+        """Fetches ``{name: url}`` in the background, skipping failures"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(name, url):
+            async with semaphore:
+                try:
+                    await self.fetch(session, name, url)
+                except Exception:
+                    datadog.statsd.increment('statsy.assets.failed', 1)
+
+        await asyncio.gather(*(fetch(k, v) for k, v in urls.items()))
+
+
+assets = AssetStore()
+
+
+def load_assets():
+    """Initializer of the render workers"""
+    assets.load_files()
+
+
+class RenderBusy(Exception):
+    pass
+
+
+class RenderPool:
+    """Runs renderers in a pool of worker processes
+
+    Renderers must be module level functions taking and returning
+    picklable values, usually image bytes in and encoded bytes out.
+    At most ``max_pending`` renders are queued or running, further ones
+    raise RenderBusy so callers can fall back to a text embed. With no
+    ``workers`` the renders run on the loop's default thread executor.
+    Each renderer gets ``format``, the encoding to use, as its last argument.
+    """
+
+    def __init__(self, workers, *, max_pending=None, format='png', loop=None):
+        if format not in FORMATS:
+            raise ValueError(f'Unknown image format {format!r}')
+
+        self.loop = loop or asyncio.get_event_loop()
+        self.format = format
+        self.max_pending = max_pending or max(workers, 1) * 4
+        self.pending = 0
+        if workers:
+            self.executor = ProcessPoolExecutor(workers, initializer=load_assets)
+        else:
+            self.executor = None
+            load_assets()
+
+    async def run(self, name, func, *args):
+        if self.pending >= self.max_pending:
+            datadog.statsd.increment('statsy.render.rejected', 1, [f'image:{name}'])
+            raise RenderBusy(name)
+
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            data = await self.loop.run_in_executor(self.executor, func, *args, self.format)
+        finally:
+            self.pending -= 1
+            datadog.statsd.histogram('statsy.render.duration', time.perf_counter() - started, [f'image:{name}'])
+
+        datadog.statsd.histogram('statsy.render.bytes', len(data), [f'image:{name}', f'format:{self.format}'])
+        return data
+
+    def filename(self, name):
+        return f'{name}.{self.format}'
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
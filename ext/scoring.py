@@ -0,0 +1,52 @@
+import heapq
+from collections import Counter
+
+# divisor of each statistic in the score of a clan member
+CR_WEIGHTS = {'donations': 5, 'war': 3, 'trophies': 7}
+COC_WEIGHTS = {'donations': 5, 'versusTrophies': 7, 'trophies': 7}
+
+
+def war_participation(wars):
+    """Counts the wars of a war log each member took part in, in one pass"""
+    # paginated responses keep the fetched wars in raw_data
+    wars = getattr(wars, 'raw_data', wars) or []
+    counts = Counter()
+    for w in wars:
+        counts.update({i.tag for i in w.participants})
+    return counts
+
+
+def member_scores(columns, weights):
+    """Scores every member at once
+
+    ``columns`` maps each statistic of ``weights`` to the
+    values of all the members, in the same order.
+    """
+    divided = [[v / weight for v in columns[stat]] for stat, weight in weights.items()]
+    return [sum(i) / len(weights) for i in zip(*divided)]
+
+
+def cr_scores(members, war_counts):
+    return member_scores({
+        'donations': [m.donations for m in members],
+        'war': [war_counts[m.tag] for m in members],
+        'trophies': [m.trophies for m in members]
+    }, CR_WEIGHTS)
+
+
+def coc_scores(members):
+    return member_scores({
+        'donations': [m['donations'] for m in members],
+        'versusTrophies': [m.get('versusTrophies', 0) for m in members],
+        'trophies': [m['trophies'] for m in members]
+    }, COC_WEIGHTS)
+
+
+def highest(members, scores, n=4):
+    """Returns the ``n`` members with the highest scores, best first"""
+    return [members[i] for i in heapq.nlargest(n, range(len(members)), key=scores.__getitem__)]
+
+
+def lowest(members, scores, n=4):
+    """Returns the ``n`` members with the lowest scores, worst first"""
+    return [members[i] for i in heapq.nsmallest(n, range(len(members)), key=scores.__getitem__)]
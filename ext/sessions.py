@@ -0,0 +1,91 @@
+import time
+
+import aiohttp
+import datadog
+
+# connection pool of each group of upstream hosts
+# limit: connections of the group, timeout: total seconds of a request
+SESSION_GROUPS = {
+    'default': {'limit': 20, 'timeout': 30},
+    'discord': {'limit': 20, 'timeout': 15},
+    'clashroyale': {'limit': 50, 'timeout': 25},
+    'brawlstars': {'limit': 30, 'timeout': 35},
+    'clashofclans': {'limit': 30, 'timeout': 25},
+    'fortnite': {'limit': 10, 'timeout': 25},
+    'assets': {'limit': 20, 'timeout': 30}
+}
+
+
+class SessionManager:
+    """One aiohttp session per group of upstream hosts
+
+    Every group has its own connector, so a slow upstream, such as the
+    card art CDN, can only exhaust its own connections. Connectors keep
+    connections alive for ``keepalive`` seconds and cache DNS lookups
+    for ``dns_ttl`` seconds. Time spent waiting for a free connection
+    and connection reuse are reported per group.
+    """
+
+    def __init__(self, groups=SESSION_GROUPS, *, keepalive=30, dns_ttl=300, connect_timeout=10, loop=None):
+        self.loop = loop
+        self.groups = groups
+        self.keepalive = keepalive
+        self.dns_ttl = dns_ttl
+        self.connect_timeout = connect_timeout
+        self.sessions = {}
+
+    def get(self, group):
+        """Returns the session of ``group``, creating it the first time"""
+        try:
+            return self.sessions[group]
+        except KeyError:
+            pass
+
+        config = self.groups[group]
+        connector = aiohttp.TCPConnector(
+            limit=config['limit'],
+            ttl_dns_cache=self.dns_ttl,
+            keepalive_timeout=self.keepalive,
+            loop=self.loop
+        )
+        self.sessions[group] = session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=config['timeout'], connect=self.connect_timeout),
+            trace_configs=[self.trace_config(group)],
+            loop=self.loop
+        )
+        return session
+
+    @staticmethod
+    def trace_config(group):
+        tags = [f'group:{group}']
+
+        async def queued_start(session, ctx, params):
+            ctx.queued = time.perf_counter()
+
+        async def queued_end(session, ctx, params):
+            datadog.statsd.histogram('statsy.http.queue_wait', time.perf_counter() - ctx.queued, tags)
+
+        async def reused(session, ctx, params):
+            datadog.statsd.increment('statsy.http.connections', 1, tags + ['reused:True'])
+
+        async def created(session, ctx, params):
+            datadog.statsd.increment('statsy.http.connections', 1, tags + ['reused:False'])
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_queued_start.append(queued_start)
+        trace_config.on_connection_queued_end.append(queued_end)
+        trace_config.on_connection_reuseconn.append(reused)
+        trace_config.on_connection_create_end.append(created)
+        return trace_config
+
+    def stats(self):
+        """Yields ``(group, connections in use, limit)`` of every session"""
+        for group, session in self.sessions.items():
+            connector = session.connector
+            # aiohttp keeps the connections handed out to requests in _acquired
+            yield group, len(getattr(connector, '_acquired', ())), connector.limit
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
@@ -0,0 +1,159 @@
+import asyncio
+import time
+from collections import defaultdict, namedtuple
+
+import datadog
+import discord
+
+from ext.ratelimit import TokenBucket
+
+Subscription = namedtuple('Subscription', 'guild_id channel_id mention')
+
+
+def percentile(values, p):
+    """Returns the ``p`` percentile of sorted ``values``"""
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class TournamentLog:
+    """Delivers tournament alerts to every subscribed channel
+
+    Subscriptions are indexed by tournament type in memory. They are
+    loaded once, then kept up to date from the guild config writes, so
+    an alert costs no database reads. The channel and role of each
+    subscription are resolved once and dropped on guild, channel and
+    role events. Every subscription is a different guild, so the
+    deliveries never share a route and are sent concurrently, up to
+    ``concurrency`` at once and ``rate`` requests per second overall to
+    stay under the global rate limit.
+    """
+
+    def __init__(self, bot, *, concurrency=25, rate=40):
+        self.bot = bot
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate=rate, capacity=rate)
+        self.guilds = {}
+        self.types = defaultdict(dict)
+        self.resolved = {}
+        self.loaded = False
+        bot.guild_config.watchers.append(self.sync)
+
+    async def load(self):
+        """Indexes the subscriptions of every guild"""
+        query = self.bot.mongo.config.guilds.find({'tournament': {'$exists': True}}, {'guild_id': 1, 'tournament': 1})
+        async for g in query:
+            self.subscribe(int(g['guild_id']), g['tournament'])
+        self.loaded = True
+
+    def subscribe(self, guild_id, config):
+        self.unsubscribe(guild_id)
+        channel_id = config.get('channel_id')
+        types = config.get('types')
+        if not channel_id or not types:
+            # partial or legacy config, it receives no alerts
+            return
+        subscription = Subscription(guild_id, int(channel_id), config.get('mention'))
+        self.guilds[guild_id] = subscription, types
+        for i in types:
+            self.types[i][guild_id] = subscription
+
+    def unsubscribe(self, guild_id):
+        subscription, types = self.guilds.pop(guild_id, (None, ()))
+        for i in types:
+            self.types[i].pop(guild_id, None)
+        self.resolved.pop(subscription, None)
+
+    def sync(self, guild_id, data):
+        """Updates the index from a guild config, see GuildConfigCache.watchers"""
+        if data.get('tournament'):
+            self.subscribe(int(guild_id), data['tournament'])
+        else:
+            self.unsubscribe(int(guild_id))
+
+    def forget(self, guild_id):
+        """Resolves the channel and role of a guild again on its next alert"""
+        subscription = self.guilds.get(guild_id, (None,))[0]
+        self.resolved.pop(subscription, None)
+
+    def is_channel(self, channel):
+        """Returns whether ``channel`` receives the alerts of its guild"""
+        subscription = self.guilds.get(channel.guild.id, (None,))[0]
+        return subscription is not None and subscription.channel_id == channel.id
+
+    def subscriptions(self, types):
+        """Returns the unique subscriptions to any of ``types``"""
+        return {s for i in types for s in self.types.get(i, {}).values()}
+
+    def resolve(self, subscription):
+        """Returns the channel and the role of a subscription, cached"""
+        try:
+            return self.resolved[subscription]
+        except KeyError:
+            pass
+
+        guild = self.bot.get_guild(subscription.guild_id)
+        channel = guild and guild.get_channel(subscription.channel_id)
+        role = None
+        if channel and subscription.mention:
+            try:
+                role = discord.utils.get(guild.roles, id=int(subscription.mention))
+            except ValueError:
+                # mention is @here or @everyone
+                pass
+
+        self.resolved[subscription] = channel, role
+        return channel, role
+
+    async def deliver(self, subscription, em, content, started):
+        """Sends an alert to one subscription, returns its latency or None if it was skipped"""
+        channel, role = self.resolve(subscription)
+        if channel is None:
+            return None
+
+        if role is not None:
+            mention = role.mention
+        elif subscription.mention and subscription.mention.startswith('@'):
+            mention = subscription.mention
+        else:
+            mention = None
+        change_permissions = role is not None and not role.mentionable
+
+        async with self.semaphore:
+            await self.bucket.acquire(3 if change_permissions else 1)
+            try:
+                if change_permissions:
+                    await role.edit(mentionable=True)
+                try:
+                    await channel.send(content=content(mention), embed=em)
+                finally:
+                    if change_permissions:
+                        await role.edit(mentionable=False)
+            except (discord.Forbidden, discord.NotFound):
+                # resolve again next time, the channel or role may be gone
+                self.resolved.pop(subscription, None)
+                raise
+
+        return time.time() - started
+
+    async def send(self, types, em, content):
+        """Sends ``em`` to every subscription to any of ``types``
+
+        ``content`` is called with the mention of each subscription,
+        or None, and returns the message to send with the embed.
+        """
+        if not self.loaded:
+            await self.load()
+
+        started = time.time()
+        results = await asyncio.gather(
+            *(self.deliver(s, em, content, started) for s in self.subscriptions(types)),
+            return_exceptions=True
+        )
+
+        latencies = sorted(i for i in results if isinstance(i, float))
+        failed = sum(isinstance(i, Exception) for i in results)
+        datadog.statsd.increment('statsy.tournament.delivered', len(latencies))
+        datadog.statsd.increment('statsy.tournament.failed', failed)
+        if latencies:
+            for p in (50, 95, 99):
+                datadog.statsd.gauge(f'statsy.tournament.latency.p{p}', percentile(latencies, p))
@@ -90,26 +90,49 @@ def get_stack_variable(name):
         del stack
 
 
-def e(name, *, should_format=True, ctx=None):
-    ctx = ctx or get_stack_variable('ctx') or get_stack_variable('self')
-
-    name = str(name)
-    if should_format:
-        name = name.lower()
-        replace = {
-            # new: to_replace
-            '': ['.', ' ', '_', '-'],
-            'chestgold': 'chestgolden'
-        }
-        for key, value in replace.items():
-            if isinstance(value, list):
-                for val in value:
-                    name = name.replace(val, key)
-            else:
-                name = name.replace(value, key)
-
-    emoji = discord.utils.get(ctx.bot.game_emojis, name=name)
-    return emoji or name
+@functools.lru_cache(maxsize=4096)
+def format_emoji_name(name):
+    """Normalizes a name to the naming used on the emoji servers"""
+    name = name.lower()
+    replace = {
+        # new: to_replace
+        '': ['.', ' ', '_', '-'],
+        'chestgold': 'chestgolden'
+    }
+    for key, value in replace.items():
+        if isinstance(value, list):
+            for val in value:
+                name = name.replace(val, key)
+        else:
+            name = name.replace(value, key)
+    return name
+
+
+class EmojiRegistry:
+    """Index of the emojis on the emoji servers keyed by name"""
+
+    def __init__(self):
+        self.emojis = {}
+
+    def build(self, emojis):
+        index = {}
+        for emoji in emojis:
+            # first emoji wins, like discord.utils.get
+            index.setdefault(emoji.name, emoji)
+        self.emojis = index
+
+    def get(self, name, *, should_format=True):
+        name = str(name)
+        if should_format:
+            name = format_emoji_name(name)
+        return self.emojis.get(name, name)
+
+
+emojis = EmojiRegistry()
+
+
+def e(name, *, should_format=True):
+    return emojis.get(name, should_format=should_format)
 
 
 def cdir(obj):
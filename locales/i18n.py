@@ -1,15 +1,15 @@
+import contextvars
 import re
 import os
+from functools import lru_cache
 from pathlib import Path
 
 from discord.ext import commands
 from dotenv import find_dotenv, load_dotenv
 
-from ext.utils import get_stack_variable
-
 """Modified version of https://github.com/Cog-Creators/Red-DiscordBot/blob/V3/develop/redbot/core/i18n.py"""
 
-__all__ = ["reload_locales", "cog_i18n", "Translator"]
+__all__ = ["reload_locales", "cog_i18n", "Translator", "current_language"]
 
 load_dotenv(find_dotenv())
 
@@ -23,6 +23,9 @@ MSGSTR = 'msgstr "'
 
 _translators = []
 
+# set in Statsy.get_context, read by every Translator call in the same task
+current_language = contextvars.ContextVar('current_language', default='messages')
+
 
 def reload_locales():
     for translator in _translators:
@@ -131,6 +134,12 @@ def _normalize(string, remove_newline=False):
     return string
 
 
+@lru_cache(maxsize=4096)
+def _msgid(untranslated):
+    """Memoized normalization of an untranslated string"""
+    return _normalize(untranslated, True)
+
+
 def get_locale_path(locale: str) -> Path:
     """
     Gets the folder path containing localization files.
@@ -169,16 +178,15 @@ class Translator:
 
         self.load_translations()
 
-    def __call__(self, untranslated: str):
+    def __call__(self, untranslated: str, language: str = None):
         """Translate the given string.
 
         This will look for the string in the translator's :code:`.pot` file,
-        with respect to the current locale.
+        with respect to ``language`` or, if not given, the language of the
+        current context.
         """
-        ctx = get_stack_variable('ctx')
-        normalized_untranslated = _normalize(untranslated, True)
         try:
-            return self.translations[ctx.language][normalized_untranslated]
+            return self.translations[language or current_language.get()][_msgid(untranslated)]
         except KeyError:
             return untranslated
 
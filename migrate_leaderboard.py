@@ -0,0 +1,45 @@
+"""One-shot import of the Firebase leaderboard dump into mongo
+
+Usage: python migrate_leaderboard.py
+Reads the `firebase` and `mongo` variables from the environment or .env
+"""
+
+import asyncio
+import json
+import os
+from base64 import b64decode
+
+import requests
+from dotenv import find_dotenv, load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from oauth2client.service_account import ServiceAccountCredentials
+
+from ext.leaderboard import LeaderboardStore
+
+FIREBASE_URL = 'https://statsy-fourjr.firebaseio.com/players.json'
+
+
+def fetch_players():
+    scopes = [
+        "https://www.googleapis.com/auth/userinfo.email",
+        "https://www.googleapis.com/auth/firebase.database"
+    ]
+    credentials = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(b64decode(os.getenv('firebase')).decode()), scopes=scopes)
+    resp = requests.get(FIREBASE_URL, headers={'Authorization': f'Bearer {credentials.get_access_token().access_token}'})
+    resp.raise_for_status()
+    return resp.json() or {}
+
+
+async def migrate():
+    players = fetch_players()
+    print(f'Fetched {len(players)} players')
+
+    store = LeaderboardStore(AsyncIOMotorClient(os.getenv('mongo')).config.leaderboard)
+    await store.create_indexes()
+    imported = await store.import_players(players)
+    print(f'Imported {imported} players')
+
+
+if __name__ == '__main__':
+    load_dotenv(find_dotenv())
+    asyncio.get_event_loop().run_until_complete(migrate())
@@ -10,7 +10,6 @@ import sys
 import traceback
 from collections import defaultdict
 
-import aiohttp
 import brawlstats
 import clashroyale
 import datadog
@@ -20,13 +19,17 @@ from discord.ext import commands
 from dotenv import find_dotenv, load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 
-from ext import utils
+from ext import backends, utils
 from ext.context import CustomContext
 from ext.view import CustomView
 from ext.command import command
+from ext.cache import ResponseCache
+from ext.config import GuildConfigCache
 from ext.utils import InvalidPlatform, InvalidBSTag, InvalidTag, NoTag, APIError
 from ext.log import LoggingHandler
-from locales.i18n import Translator
+from ext.render import RenderPool
+from ext.sessions import SessionManager
+from locales.i18n import Translator, current_language
 
 
 _ = Translator('Core', __file__)
@@ -57,8 +60,21 @@ class Statsy(commands.AutoShardedBot):
 
     def __init__(self):
         super().__init__(case_insensitive=True, command_prefix=None)
-        self.session = aiohttp.ClientSession(loop=self.loop)
+        self.sessions = SessionManager(loop=self.loop)
+        self.session = self.sessions.get('default')
         self.mongo = AsyncIOMotorClient(os.getenv('mongo'))
+        self.guild_config = GuildConfigCache(self.mongo.config.guilds)
+        self.api_cache = ResponseCache({
+            'clashroyale': 96 * 1024**2,
+            'brawlstars': 32 * 1024**2,
+            'clashofclans': 32 * 1024**2
+        }, backend=backends.from_url(os.getenv('cache_backend')))
+        self.render_pool = RenderPool(
+            int(os.getenv('render_workers', 2)),
+            max_pending=int(os.getenv('render_queue', 0)) or None,
+            format=os.getenv('render_format', 'png'),
+            loop=self.loop
+        )
         self.uptime = datetime.datetime.utcnow()
         self.process = psutil.Process()
         self.remove_command('help')
@@ -80,19 +96,20 @@ class Statsy(commands.AutoShardedBot):
 
         self.error_hook = discord.Webhook.from_url(
             os.getenv('error_hook'),
-            adapter=discord.AsyncWebhookAdapter(self.session)
+            adapter=discord.AsyncWebhookAdapter(self.sessions.get('discord'))
         )
         self.log_hook = discord.Webhook.from_url(
             os.getenv('log_hook'),
-            adapter=discord.AsyncWebhookAdapter(self.session)
+            adapter=discord.AsyncWebhookAdapter(self.sessions.get('discord'))
         )
         self.guild_hook = discord.Webhook.from_url(
             os.getenv('guild_hook'),
-            adapter=discord.AsyncWebhookAdapter(self.session)
+            adapter=discord.AsyncWebhookAdapter(self.sessions.get('discord'))
         )
         self.command_logger = logging.getLogger('statsy.commands')
         self.main_logger = logging.getLogger('statsy.main')
-        self.main_logger.addHandler(LoggingHandler(logging.INFO))
+        self.log_handler = LoggingHandler(logging.INFO, self.sessions.get('discord'), loop=self.loop)
+        self.main_logger.addHandler(self.log_handler)
 
         try:
             self.loop.run_until_complete(self.start(os.getenv('token')))
@@ -111,7 +128,11 @@ class Statsy(commands.AutoShardedBot):
                 self.datadog_loop.cancel()
                 self.event_notifications_loop.cancel()
             self.loop.run_until_complete(self.logout())
-            self.loop.run_until_complete(self.session.close())
+            self.loop.run_until_complete(self.log_handler.shutdown())
+            self.loop.run_until_complete(self.sessions.close())
+            self.render_pool.close()
+            if self.api_cache.backend is not None:
+                self.loop.run_until_complete(self.api_cache.backend.close())
             self.loop.close()
 
     def get_game_emojis(self):
@@ -151,16 +172,34 @@ class Statsy(commands.AutoShardedBot):
 
         id = getattr(message.guild, 'id', None)
 
-        cfg = await self.mongo.config.guilds.find_one({'guild_id': str(id)}) or {}
+        if self.guild_config.prefixes_loaded:
+            prefix = self.guild_config.get_prefix(id)
+        else:
+            prefix = (await self.guild_config.get(id)).get('prefix', '!')
 
         prefixes = [
             f'<@{self.user.id}> ',
             f'<@!{self.user.id}> ',
-            cfg.get('prefix', '!')
+            prefix
         ]
 
         return prefixes
 
+    def could_be_command(self, message):
+        """Checks without any I/O if a message can start with a prefix"""
+        content = message.content
+        if content.startswith('<@'):
+            # mention prefix
+            return True
+
+        if self.dev_mode:
+            return content.startswith('./')
+
+        if not self.guild_config.prefixes_loaded:
+            return True
+
+        return content.startswith(self.guild_config.get_prefix(getattr(message.guild, 'id', None)))
+
     async def on_connect(self):
         """Called when the bot has established a
         gateway connection with discord
@@ -170,6 +209,7 @@ class Statsy(commands.AutoShardedBot):
         print('----------------------------')
         datadog.statsd.increment('statsy.connect')
         self.blacklist = await self.mongo.config.admin.find_one({'_id': 'blacklist'})
+        await self.guild_config.load_prefixes()
         async for g in self.mongo.config.guilds.find({'default_game': {'$exists': True}}):
             self.default_game[int(g['guild_id'])] = g['default_game']
         print('Guild syncing complete')
@@ -192,11 +232,18 @@ class Statsy(commands.AutoShardedBot):
               f'Users: {len(self.users)}\n' \
               '----------------------------'
         self.game_emojis = self.get_game_emojis()
+        utils.emojis.build(self.game_emojis)
         self.main_logger.info(fmt)
         print(fmt)
         if not self.dev_mode:
             await self.log_hook.send(f'```{fmt}```')
 
+    async def on_guild_emojis_update(self, guild, before, after):
+        """Keeps the emoji registry in sync with the emoji servers"""
+        if guild.id in self.emoji_servers:
+            self.game_emojis = self.get_game_emojis()
+            utils.emojis.build(self.game_emojis)
+
     async def on_shard_connect(self, shard_id):
         """Called when a shard has successfuly
         connected to the gateway.
@@ -302,9 +349,10 @@ class Statsy(commands.AutoShardedBot):
         ctx.command = self.all_commands.get(invoker)
 
         if isinstance(ctx.channel, discord.TextChannel):
-            ctx.language = (await self.mongo.config.guilds.find_one({'guild_id': str(ctx.guild.id)}) or {}).get('language', 'messages')
+            ctx.language = (await self.guild_config.get(ctx.guild.id)).get('language', 'messages')
         else:
             ctx.language = 'messages'
+        current_language.set(ctx.language)
 
         return ctx
 
@@ -392,7 +440,7 @@ class Statsy(commands.AutoShardedBot):
     async def on_message(self, message):
         """Called when a message is sent/recieved."""
         self.messages_sent += 1
-        if not message.author.bot:
+        if not message.author.bot and self.could_be_command(message):
             await self.process_commands(message)
 
     async def backup_task(self):
@@ -434,12 +482,20 @@ class Statsy(commands.AutoShardedBot):
                 ('statsy.channels', len([i.id for g in self.guilds for i in g.channels])),
                 ('statsy.memory', self.process.memory_full_info().uss / 1024**2),
                 ('statsy.tags_saved', sum([await self.mongo.player_tags[i].count_documents({}) for i in games])),
-                ('statsy.cache', len(self.get_cog('Clash_Royale').cache), ['game:clashroyale']),
-                ('statsy.cache', len(self.get_cog('Clash_Of_Clans').cache), ['game:clashofclans']),
-                ('statsy.cache', len(self.get_cog('Brawl_Stars').cache), ['game:brawlstars']),
                 ('statsy.claninfo', await self.mongo.config.guilds.count_documents({'claninfo': {'$exists': True}})),
                 ('statsy.tournament', await self.mongo.config.guilds.count_documents({'tournament': {'$exists': True}}))
             ]
+            for game, cache in self.api_cache.namespaces.items():
+                metrics += [
+                    ('statsy.cache', cache.currsize, [f'game:{game}']),
+                    ('statsy.cache.hit_ratio', cache.hit_ratio, [f'game:{game}']),
+                    ('statsy.cache.evictions', cache.evictions, [f'game:{game}'])
+                ]
+            for group, in_use, limit in self.sessions.stats():
+                metrics += [
+                    ('statsy.http.pool', in_use, [f'group:{group}']),
+                    ('statsy.http.pool_utilization', in_use / limit if limit else 0, [f'group:{group}'])
+                ]
             for i in metrics:
                 try:
                     tags = i[2]